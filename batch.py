@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pipeline import Agents, process_media, analyze_video, diagnose
+from llm.batches import MessageBatchJob, batch_diagnose
+from llm.scheduler import BATCH, priority
+from llm.usage import LEDGER
+from utils.DSM5MCP import DSM5_ASD_DATA
+from utils.metrics import METRICS_PORT, inc, observe, start_metrics_server
+from utils.tenants import tenant
+from utils.tracing import case
+
+def read_manifest(path):
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = [json.loads(line) for line in file if line.strip()]
+
+    cases = []
+    for row in rows:
+
+        history = row.get("history")
+        if not history and row.get("history_path"):
+            with open(os.path.join(base_dir, row["history_path"]), "r", encoding="utf-8") as history_file:
+                history = history_file.read()
+
+        cases.append({
+            "case_id": str(row["case_id"]),
+            "age": int(row["age"]),
+            "history": history or "",
+            "video_path": os.path.join(base_dir, row["video_path"])
+        })
+
+    return cases
+
+def finished_cases(results_path):
+
+    finished = set()
+    if not os.path.exists(results_path):
+        return finished
+
+    with open(results_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash; that case simply runs again
+                continue
+            if result.get("status") == "ok":
+                finished.add(result["case_id"])
+
+    return finished
+
+class BatchRunner:
+
+    def __init__(self, agents, results_file, media_pool, media_workers, llm_concurrency, whisper_model):
+
+        self.agents = agents
+        self.results_file = results_file
+        self.media_pool = media_pool
+        self.media_slots = asyncio.Semaphore(media_workers)
+        self.llm_slots = asyncio.Semaphore(llm_concurrency)
+        self.whisper_model = whisper_model
+
+    async def call_llm(self, func, *args):
+
+        async with self.llm_slots:
+            return await asyncio.to_thread(func, *args)
+
+    async def run_case(self, patient):
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        with case(patient["case_id"]) as case_id:
+            # History analysis doesn't need the media, so it overlaps with decoding
+            history_task = asyncio.create_task(self.call_llm(self.agents.history.analyze, patient["history"]))
+
+            async with self.media_slots:
+                media = await loop.run_in_executor(self.media_pool, process_media, patient["video_path"], self.whisper_model)
+
+            history_analysis, video_analysis, audio_analysis = await asyncio.gather(
+                history_task,
+                self.call_llm(analyze_video, self.agents, patient["video_path"], media["images"]),
+                self.call_llm(self.agents.audio.analyze, media["transcript"])
+            )
+            diagnosis = await self.call_llm(diagnose, self.agents, patient["age"], history_analysis, video_analysis, audio_analysis)
+
+        return {
+            "case_id": case_id,
+            "status": "ok",
+            "age": patient["age"],
+            "history_analysis": history_analysis,
+            "video_analysis": video_analysis,
+            "audio_analysis": audio_analysis,
+            "diagnosis": diagnosis,
+            "usage": LEDGER.pop(case_id),
+            "elapsed_s": round(time.perf_counter() - start, 3)
+        }
+
+    def write(self, result):
+
+        self.results_file.write(json.dumps(result) + "\n")
+        self.results_file.flush()
+        os.fsync(self.results_file.fileno())
+
+    async def run_one(self, patient):
+
+        try:
+            result = await self.run_case(patient)
+        except Exception as error:
+            result = {"case_id": patient["case_id"], "status": "error", "error": f"{type(error).__name__}: {error}"}
+
+        inc("neuroscope_cases_total", status="done" if result["status"] == "ok" else "failed")
+        if "elapsed_s" in result:
+            observe("neuroscope_case_duration_seconds", result["elapsed_s"])
+        self.write(result)
+        print(f"{result['case_id']}: {result['status']}", flush=True)
+
+    async def run(self, patients, concurrency):
+
+        # A fixed set of workers takes cases in manifest order, so only that many are in flight however long the manifest
+        pending = iter(patients)
+
+        async def worker():
+            for patient in pending:
+                await self.run_one(patient)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    async def prepare_media(self, patient):
+
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.media_slots:
+                media = await loop.run_in_executor(self.media_pool, process_media, patient["video_path"], self.whisper_model)
+        except Exception as error:
+            self.write({"case_id": patient["case_id"], "status": "error", "error": f"{type(error).__name__}: {error}"})
+            return None
+        return {**patient, **media}
+
+    async def run_batched(self, patients, poll_interval, chunk_size):
+
+        # Media for a chunk is decoded in the process pool, then its LLM work goes out as Message Batches
+        for start in range(0, len(patients), chunk_size):
+
+            prepared = await asyncio.gather(*(self.prepare_media(patient) for patient in patients[start:start + chunk_size]))
+            prepared = [patient for patient in prepared if patient is not None]
+
+            job = MessageBatchJob(self.agents.diagnosis.client, poll_interval)
+            results = await asyncio.to_thread(batch_diagnose, self.agents, prepared, DSM5_ASD_DATA, job)
+
+            for result in results:
+                self.write(result)
+                print(f"{result['case_id']}: {result['status']}", flush=True)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Screen a manifest of archived cases without the Streamlit UI")
+    parser.add_argument("manifest", help="CSV or JSONL with case_id, age, video_path and history or history_path")
+    parser.add_argument("--out", default="results.jsonl")
+    parser.add_argument("--media-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--case-concurrency", type=int, help="Cases in flight at once (default: media workers + LLM concurrency)")
+    parser.add_argument("--whisper-model", help="Overrides the model size from the Whisper profile")
+    parser.add_argument("--batch-api", action="store_true", help="Send LLM requests through Message Batches instead of one by one")
+    parser.add_argument("--batch-size", type=int, default=500, help="Cases per Message Batches submission")
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--tenant", help="Clinic the screening is run for, for fair sharing and quotas")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Serve Prometheus metrics on this port while screening")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    patients = read_manifest(args.manifest)
+    done = finished_cases(args.out)
+    pending = [patient for patient in patients if patient["case_id"] not in done]
+    print(f"{len(done)} cases already finished, {len(pending)} to run", flush=True)
+
+    # Every call from manifest screening is tagged batch priority and charged to the given tenant
+    with priority(BATCH), tenant(args.tenant), ProcessPoolExecutor(max_workers=args.media_workers) as media_pool, open(args.out, "a", encoding="utf-8") as results_file:
+        runner = BatchRunner(Agents(), results_file, media_pool, args.media_workers, args.llm_concurrency, args.whisper_model)
+        if args.batch_api:
+            asyncio.run(runner.run_batched(pending, args.poll_interval, args.batch_size))
+        else:
+            asyncio.run(runner.run(pending, args.case_concurrency or args.media_workers + args.llm_concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from benchmarks.synthetic import make_synthetic_video
+from utils.image_utils import extract_frames
+from utils.tracing import case
+
+def time_extraction(video_path, work_dir, interval, max_frames, workers):
+
+    frame_dir = tempfile.mkdtemp(dir=work_dir)
+    start = time.perf_counter()
+    with case():
+        saved = extract_frames(video_path, frame_dir, interval, max_frames=max_frames, workers=workers)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(frame_dir)
+    return saved, elapsed
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare sequential and multi-process frame extraction")
+    parser.add_argument("--seconds", type=float, default=600)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--interval", type=float, default=2)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8, os.cpu_count() or 1])
+    parser.add_argument("--video", help="Benchmark an existing video instead of generating one")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="neuroscope_decode_")
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(work_dir, "synthetic.mp4")
+        make_synthetic_video(video_path, args.seconds, args.width, args.height, args.fps)
+
+    max_frames = int(args.seconds / args.interval) + 1
+    saved, baseline = time_extraction(video_path, work_dir, args.interval, max_frames, 0)
+    report = {"frames": saved, "sequential_s": baseline, "parallel": {}}
+
+    for workers in sorted(set(args.workers)):
+        saved, elapsed = time_extraction(video_path, work_dir, args.interval, max_frames, workers)
+        report["parallel"][workers] = {"frames": saved, "elapsed_s": elapsed, "speedup": baseline / elapsed if elapsed else None}
+
+    shutil.rmtree(work_dir)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
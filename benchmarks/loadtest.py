@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import aiohttp
+from benchmarks.pipeline_bench import percentile
+from benchmarks.synthetic import make_synthetic_video
+
+async def upload(session, base_url, video_path):
+
+    async def chunks():
+        with open(video_path, "rb") as file:
+            while chunk := file.read(1 << 20):
+                yield chunk
+
+    async with session.post(f"{base_url}/uploads", data=chunks()) as response:
+        response.raise_for_status()
+        return (await response.json())["upload_id"]
+
+async def wait_for_case(session, base_url, case_id):
+
+    async with session.get(f"{base_url}/cases/{case_id}/events") as response:
+        async for line in response.content:
+            if line.startswith(b"data:"):
+                event = json.loads(line[len(b"data:"):])
+                if event["stage"] in ("done", "failed"):
+                    return event["stage"]
+    return "disconnected"
+
+async def run_case(session, base_url, upload_id, history, stats):
+
+    start = time.perf_counter()
+    async with session.post(f"{base_url}/cases", json={"age": 6, "history": history, "upload_id": upload_id}) as response:
+        stats["submit_latency"].append(time.perf_counter() - start)
+        if response.status == 429:
+            stats["rejected"] += 1
+            return
+        response.raise_for_status()
+        case_id = (await response.json())["case_id"]
+
+    outcome = await wait_for_case(session, base_url, case_id)
+    stats[outcome] = stats.get(outcome, 0) + 1
+    stats["case_latency"].append(time.perf_counter() - start)
+
+async def load_test(args):
+
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(tempfile.mkdtemp(prefix="neuroscope_load_"), "synthetic.mp4")
+        make_synthetic_video(video_path, args.seconds, args.width, args.height, args.fps)
+
+    with open(args.history, "r", encoding="utf-8") as file:
+        history = file.read()
+
+    stats = {"submit_latency": [], "case_latency": [], "rejected": 0}
+    timeout = aiohttp.ClientTimeout(total=None)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        upload_id = await upload(session, args.url, video_path)
+
+        start = time.perf_counter()
+        tasks = []
+        for _ in range(args.cases):
+            tasks.append(asyncio.create_task(run_case(session, args.url, upload_id, history, stats)))
+            await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "cases": args.cases,
+        "rate_per_s": args.rate,
+        "elapsed_s": elapsed,
+        "done": stats.get("done", 0),
+        "failed": stats.get("failed", 0),
+        "rejected_429": stats["rejected"],
+        "throughput_cases_per_s": stats.get("done", 0) / elapsed if elapsed else None,
+        "submit_p50_s": percentile(stats["submit_latency"], 50),
+        "submit_p95_s": percentile(stats["submit_latency"], 95),
+        "case_p50_s": percentile(stats["case_latency"], 50),
+        "case_p95_s": percentile(stats["case_latency"], 95)
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Load-test the diagnosis HTTP API (run the server with NEUROSCOPE_LLM_MODE=replay)")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--cases", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5.0, help="Case submissions per second")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--video")
+    parser.add_argument("--history", default=os.path.join("DemoMedia", "Data1.txt"))
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(load_test(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
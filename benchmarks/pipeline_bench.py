@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import make_synthetic_video
+from llm.transport import LATENCY_PROFILES, DEFAULT_REPLAY_DIR, ReplayStore, ReplayTransport
+from llm.history import HistoryAgent
+from llm.audioanalyze import AudioAgent
+from llm.videoanalyze import VisionAgent
+from llm.diagnosisagent import DiagnosisAgent
+from utils.image_utils import extract_frames, get_encoded_frames
+from utils.audio_utils import extract_audio, get_timestamped_transcript, transcript_structure
+from utils.tracing import case
+
+MCP_TOOL_CALLS = (
+    ("query_diagnostic_criteria", {"criterion": "A"}),
+    ("query_diagnostic_criteria", {"criterion": "B"}),
+    ("get_severity_specifiers", {"domain": "social_communication"}),
+    ("evaluate_comorbidity", {"symptom_profile": {}, "comorbid_indicators": ["anxiety"]}),
+)
+
+def percentile(values, q):
+
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def peak_rss_mb():
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, stage, func, *args, **kwargs):
+
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self, units=None):
+
+        units = units or {}
+        report = {}
+        for stage, durations in self.samples.items():
+            total = sum(durations)
+            report[stage] = {
+                "count": len(durations),
+                "p50_s": percentile(durations, 50),
+                "p95_s": percentile(durations, 95),
+                "mean_s": total / len(durations),
+                "max_s": max(durations),
+                "throughput_per_s": len(durations) / total if total else None
+            }
+            if stage in units:
+                report[stage]["units_per_s"] = units[stage] * len(durations) / total if total else None
+        return report
+
+def load_mcp_server():
+
+    try:
+        from utils.DSM5MCP import DSM5MCPServer, DSM5_ASD_DATA
+    except ImportError:
+        return None, {}
+    return DSM5MCPServer(), DSM5_ASD_DATA
+
+def run_case(timer, video_path, work_dir, agents, history_text, age, whisper_model, mcp_server, mcp_context):
+
+    history_agent, audio_agent, vision_agent, diagnosis_agent = agents
+    frame_dir = tempfile.mkdtemp(dir=work_dir)
+
+    timer.time("extract_frames", extract_frames, video_path, frame_dir)
+    images = timer.time("encode_frames", get_encoded_frames, frame_dir)
+    audio_path = timer.time("extract_audio", extract_audio, video_path)
+    if whisper_model != "":
+        segments = timer.time("transcribe", get_timestamped_transcript, audio_path, whisper_model)
+    else:
+        segments = []
+    transcript = timer.time("transcript_structure", transcript_structure, segments)
+
+    history_analysis = timer.time("history_agent", history_agent.analyze, history_text)
+    video_analysis = timer.time("vision_agent", vision_agent.analyze_frames, images)
+    audio_analysis = timer.time("audio_agent", audio_agent.analyze, transcript)
+    timer.time("diagnosis_agent", diagnosis_agent.analyze, age, history_analysis, video_analysis, audio_analysis, mcp_context)
+
+    if mcp_server is not None:
+        for name, arguments in MCP_TOOL_CALLS:
+            timer.time("mcp_dispatch", asyncio.run, mcp_server.dispatch(name, arguments))
+
+    os.remove(audio_path)
+    shutil.rmtree(frame_dir)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the NeuroScope diagnosis pipeline on synthetic media")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--age", type=int, default=6)
+    parser.add_argument("--history", default=os.path.join("DemoMedia", "Data1.txt"))
+    parser.add_argument("--whisper-model", help="Defaults to the Whisper profile; pass an empty string to skip transcription")
+    parser.add_argument("--replay-dir", default=DEFAULT_REPLAY_DIR)
+    parser.add_argument("--latency-profile", default="instant", choices=sorted(LATENCY_PROFILES))
+    parser.add_argument("--video", help="Benchmark an existing video instead of generating one")
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="neuroscope_bench_")
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(work_dir, "synthetic.mp4")
+        make_synthetic_video(video_path, args.seconds, args.width, args.height, args.fps)
+
+    with open(args.history, "r", encoding="utf-8") as file:
+        history_text = file.read()
+
+    transport = ReplayTransport(ReplayStore(args.replay_dir), LATENCY_PROFILES[args.latency_profile], synthesize_misses=True)
+    agents = (
+        HistoryAgent(transport=transport),
+        AudioAgent(transport=transport),
+        VisionAgent(transport=transport),
+        DiagnosisAgent(transport=transport)
+    )
+    mcp_server, mcp_context = load_mcp_server()
+
+    timer = StageTimer()
+    for _ in range(args.repeat):
+        with case():
+            timer.time("end_to_end", run_case, timer, video_path, work_dir, agents, history_text, args.age, args.whisper_model, mcp_server, mcp_context)
+
+    # Media stages also report seconds of video processed per wall-clock second
+    media_seconds = args.seconds if args.video is None else None
+    units = {stage: media_seconds for stage in ("extract_frames", "extract_audio", "transcribe")} if media_seconds else {}
+
+    report = {
+        "config": {
+            "seconds": args.seconds,
+            "width": args.width,
+            "height": args.height,
+            "fps": args.fps,
+            "repeat": args.repeat,
+            "video": args.video,
+            "whisper_model": args.whisper_model,
+            "latency_profile": args.latency_profile
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "stages": timer.summary(units),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+    shutil.rmtree(work_dir)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import wave
+import numpy as np
+import cv2
+
+SAMPLE_RATE = 16000
+
+# (fundamental Hz, syllables per second) for the interviewer and the patient
+SPEAKERS = ((120.0, 4.0), (230.0, 3.0))
+
+def synthesize_voice(duration, fundamental, syllable_rate, rng):
+
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    vibrato = 1 + 0.02 * np.sin(2 * np.pi * 5 * t)
+    phase = 2 * np.pi * fundamental * np.cumsum(vibrato) / SAMPLE_RATE
+
+    harmonics = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * syllable_rate * t + rng.uniform(0, np.pi)), 0, None) ** 0.5
+    noise = 0.05 * rng.standard_normal(t.size)
+
+    return (harmonics * syllables + noise) * 0.3
+
+def synthesize_dialogue(seconds, seed=0, turn_range=(1.5, 4.0), delay_range=(0.3, 2.5)):
+
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+    position = 0.5
+    speaker = 0
+    while position < seconds:
+
+        turn = min(rng.uniform(*turn_range), seconds - position)
+        fundamental, syllable_rate = SPEAKERS[speaker]
+
+        start = int(position * SAMPLE_RATE)
+        voice = synthesize_voice(turn, fundamental, syllable_rate, rng)
+        audio[start:start + voice.size] += voice[:audio.size - start]
+
+        position += turn + rng.uniform(*delay_range)
+        speaker = 1 - speaker
+
+    return np.clip(audio, -1, 1)
+
+def write_wav(path, audio):
+
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+def write_silent_video(path, seconds, width, height, fps, seed=0):
+
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    background = rng.integers(40, 80, size=(height, width, 3), dtype=np.uint8)
+
+    for index in range(int(seconds * fps)):
+
+        t = index / fps
+        frame = background.copy()
+
+        # Interviewer on the left, patient on the right with some fidgeting
+        cv2.circle(frame, (width // 4, height // 2), height // 6, (180, 160, 140), -1)
+        sway = int(width * 0.03 * np.sin(2 * np.pi * 0.7 * t))
+        cv2.circle(frame, (3 * width // 4 + sway, height // 2), height // 6, (150, 170, 200), -1)
+        cv2.putText(frame, f"{t:06.2f}", (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, max(height / 720, 0.4), (255, 255, 255), 1)
+
+        writer.write(frame)
+
+    writer.release()
+
+def make_synthetic_video(path, seconds=60, width=1280, height=720, fps=30, seed=0):
+
+    from moviepy import VideoFileClip, AudioFileClip
+
+    work_dir = tempfile.mkdtemp(prefix="neuroscope_synth_")
+    silent_path = os.path.join(work_dir, "silent.mp4")
+    audio_path = os.path.join(work_dir, "dialogue.wav")
+
+    write_silent_video(silent_path, seconds, width, height, fps, seed)
+    write_wav(audio_path, synthesize_dialogue(seconds, seed))
+
+    video = VideoFileClip(silent_path)
+    audio = AudioFileClip(audio_path)
+    video.with_audio(audio).write_videofile(path, codec="libx264", audio_codec="aac", logger=None)
+    video.close()
+    audio.close()
+
+    os.remove(silent_path)
+    os.remove(audio_path)
+    os.rmdir(work_dir)
+    return path
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from benchmarks.pipeline_bench import percentile
+from benchmarks.synthetic import make_synthetic_video
+from llm.transport import LATENCY_PROFILES, DEFAULT_REPLAY_DIR, ReplayStore, ReplayTransport
+from llm.usage import estimate_request_tokens
+from llm.videoanalyze import VisionAgent
+from utils.image_utils import extract_frames, get_encoded_frames, get_tiled_frames, parse_layout
+from utils.tracing import case
+
+def measure(encode, agent, repeat):
+
+    encode_times = []
+    call_times = []
+    for _ in range(repeat):
+
+        start = time.perf_counter()
+        images = encode()
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with case():
+            agent.analyze_frames(images)
+        call_times.append(time.perf_counter() - start)
+
+    text_tokens, picture_tokens = estimate_request_tokens(agent.build_request(images))
+    return {
+        "image_blocks": len(images),
+        "base64_bytes": sum(len(block["source"]["data"]) for block in images),
+        "image_tokens": picture_tokens,
+        "input_tokens": text_tokens + picture_tokens,
+        "encode_p50_s": percentile(encode_times, 50),
+        "vision_call_p50_s": percentile(call_times, 50),
+        "vision_call_p95_s": percentile(call_times, 95)
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare one-image-per-frame encoding against tiled contact sheets")
+    parser.add_argument("--frames", type=int, default=12, help="Frames sampled from the video")
+    parser.add_argument("--interval", type=float, default=3, help="Seconds between sampled frames")
+    parser.add_argument("--layouts", nargs="+", default=["2x2", "3x2", "3x3"])
+    parser.add_argument("--tile-width", type=int, default=512)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--replay-dir", default=DEFAULT_REPLAY_DIR)
+    parser.add_argument("--latency-profile", default="opus", choices=sorted(LATENCY_PROFILES))
+    parser.add_argument("--video", help="Benchmark an existing video instead of generating one")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="neuroscope_tiling_")
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(work_dir, "synthetic.mp4")
+        make_synthetic_video(video_path, args.frames * args.interval + 1, args.width, args.height, args.fps)
+
+    frame_dir = os.path.join(work_dir, "frames")
+    os.makedirs(frame_dir)
+    sampled = extract_frames(video_path, frame_dir, args.interval, max_frames=args.frames)
+
+    transport = ReplayTransport(ReplayStore(args.replay_dir), LATENCY_PROFILES[args.latency_profile], synthesize_misses=True)
+    agent = VisionAgent(transport=transport)
+
+    report = {
+        "config": {"frames": sampled, "interval": args.interval, "tile_width": args.tile_width, "latency_profile": args.latency_profile},
+        "per_frame": measure(lambda: get_encoded_frames(frame_dir, sampled), agent, args.repeat)
+    }
+    for layout in args.layouts:
+        report[f"tiled_{layout}"] = measure(
+            lambda: get_tiled_frames(frame_dir, sampled, parse_layout(layout), args.tile_width, args.interval),
+            agent,
+            args.repeat
+        )
+
+    shutil.rmtree(work_dir)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.pipeline_bench import peak_rss_mb
+from utils.audio_utils import DEFAULT_WHISPER_PROFILE, WHISPER_PROFILE_PATH
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".mp4", ".mov")
+
+def words(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+def word_errors(reference, hypothesis):
+
+    # Word-level Levenshtein distance, one row at a time
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+def load_references(reference_dir):
+
+    references = []
+    for name in sorted(os.listdir(reference_dir)):
+        stem, extension = os.path.splitext(name)
+        transcript_path = os.path.join(reference_dir, f"{stem}.txt")
+        if extension.lower() in AUDIO_EXTENSIONS and os.path.exists(transcript_path):
+            with open(transcript_path, "r", encoding="utf-8") as file:
+                references.append({"media": os.path.join(reference_dir, name), "text": file.read()})
+    return references
+
+def prepare_audio(references):
+
+    from utils.audio_utils import extract_audio, read_wav
+
+    # Everything is converted to WAV once, up front, so the sweep only times transcription
+    prepared = []
+    for reference in references:
+        audio_path = reference["media"]
+        if not audio_path.lower().endswith(".wav"):
+            audio_path = extract_audio(audio_path)
+        samples, sample_rate = read_wav(audio_path)
+        prepared.append({**reference, "audio": audio_path, "seconds": len(samples) / sample_rate})
+    return prepared
+
+def evaluate(profile, references):
+
+    # Runs in a fresh process per configuration so peak memory belongs to that configuration alone
+    from utils.audio_utils import get_whisper_model, get_timestamped_transcript
+
+    start = time.perf_counter()
+    get_whisper_model(profile["model_size"], profile["device"], profile["compute_type"], profile["cpu_threads"], profile["num_workers"])
+    load_s = time.perf_counter() - start
+
+    errors = 0
+    reference_words = 0
+    transcribe_s = 0.0
+    for reference in references:
+        start = time.perf_counter()
+        segments = get_timestamped_transcript(reference["audio"], profile=profile)
+        transcribe_s += time.perf_counter() - start
+
+        expected = words(reference["text"])
+        errors += word_errors(expected, words(" ".join(segment["text"] for segment in segments)))
+        reference_words += len(expected)
+
+    audio_s = sum(reference["seconds"] for reference in references)
+    return {
+        "profile": profile,
+        "load_s": load_s,
+        "transcribe_s": transcribe_s,
+        "audio_s": audio_s,
+        "real_time_factor": transcribe_s / audio_s if audio_s else None,
+        "wer": errors / reference_words if reference_words else None,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def sweep_profiles(args):
+
+    for model_size, compute_type, cpu_threads, num_workers, beam_size, threshold in itertools.product(
+        args.models, args.compute_types, args.cpu_threads, args.num_workers, args.beam_sizes, args.vad_thresholds
+    ):
+        yield {
+            **DEFAULT_WHISPER_PROFILE,
+            "model_size": model_size,
+            "compute_type": compute_type,
+            "cpu_threads": cpu_threads,
+            "num_workers": num_workers,
+            "beam_size": beam_size,
+            "vad_parameters": {"threshold": threshold}
+        }
+
+def recommend(results, wer_tolerance):
+
+    # The fastest configuration whose accuracy is within tolerance of the most accurate one
+    scored = [result for result in results if result.get("wer") is not None]
+    if not scored:
+        return None
+    best_wer = min(result["wer"] for result in scored)
+    candidates = [result for result in scored if result["wer"] <= best_wer + wer_tolerance]
+    return min(candidates, key=lambda result: (result["real_time_factor"], result["peak_rss_mb"]))
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Sweep Whisper CPU settings on reference audio and write a recommended profile")
+    parser.add_argument("reference_dir", help="Audio or video files, each with a matching .txt reference transcript")
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8", "int8_float32", "float32"])
+    parser.add_argument("--cpu-threads", nargs="+", type=int, default=[0, max(1, (os.cpu_count() or 2) // 2), os.cpu_count() or 1])
+    parser.add_argument("--num-workers", nargs="+", type=int, default=[1])
+    parser.add_argument("--beam-sizes", nargs="+", type=int, default=[1, 5])
+    parser.add_argument("--vad-thresholds", nargs="+", type=float, default=[0.5])
+    parser.add_argument("--wer-tolerance", type=float, default=0.02, help="Accepted WER above the most accurate configuration")
+    parser.add_argument("--out", default=WHISPER_PROFILE_PATH)
+    args = parser.parse_args()
+
+    references = prepare_audio(load_references(args.reference_dir))
+    if not references:
+        parser.error(f"No audio with matching .txt transcripts in {args.reference_dir}")
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for profile in sweep_profiles(args):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                result = executor.submit(evaluate, profile, references).result()
+            except Exception as error:
+                result = {"profile": profile, "error": f"{type(error).__name__}: {error}"}
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    for reference in references:
+        if reference["audio"] != reference["media"]:
+            os.remove(reference["audio"])
+
+    best = recommend(results, args.wer_tolerance)
+    if best is None:
+        raise SystemExit("Every configuration failed; no profile written")
+
+    report = {
+        "profile": best["profile"],
+        "measured": {key: value for key, value in best.items() if key != "profile"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "references": len(references),
+        "sweep": results
+    }
+    with open(args.out, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Recommended: {json.dumps(best['profile'])} (RTF {best['real_time_factor']:.3f}, WER {best['wer']:.3f}) -> {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,17 @@ class AudioAgent(BaseClaudeAgent):
 
     def analyze(self, transcript):
 
+        return self.complete(self.build_request(transcript))
+
+    def build_request(self, transcript):
+
         prompt = f"""You are a clinical analysis agent that evaluates a given transcript from a video of a patient conversating to identify unusual speech behaviors. 
 
                 Your task is to identify unusual or abnormal speech of the patient that indicate non-ideal human behavior.
                 
-                The transcript will be inputted and already structured as repetitions of: A question from an interviewer ". " The patient's response time ". " The patient's answer.
+                The transcript will be inputted as one turn per line, labelled "Interviewer" or "Patient". A patient turn that answers the interviewer also shows the patient's response time in seconds.
 
-                Assume all question sentences are from the interviewer only if they dont seem like an answer (e.g. "Coffee?" - Patient, "How long will..." - Interviewer).
+                Speaker labels come from automatic segmentation; if a line is clearly mislabelled, read it as the other speaker.
 
                 Transcript: {transcript}
 
@@ -49,13 +53,11 @@ class AudioAgent(BaseClaudeAgent):
         
         message_content = [{"type": "text", "text": prompt}]
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=1024,
-            messages=[{
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
                 "role": "user",
                 "content": message_content
             }]
-        )
-
-        return response.content[0].text
+        }
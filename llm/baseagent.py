@@ -1,12 +1,50 @@
-from anthropic import Anthropic
+from llm.transport import STUB, DEFAULT_STUB_URL, make_transport
+from llm.usage import LEDGER, AgentResult, TokenBudget
+from utils.tracing import span
+import functools
 import os
 
+@functools.lru_cache(maxsize=None)
+def get_client(api_key, base_url=None):
+    # One client per process shares the HTTP connection pool across all agents
+    from anthropic import Anthropic
+    return Anthropic(api_key=api_key, base_url=base_url)
+
 class BaseClaudeAgent:
     
-    def __init__(self, api_key="api_key", model="claude-4-opus-20250514"):
+    def __init__(self, api_key="api_key", model="claude-4-opus-20250514", transport=None, budget=None):
         
         self.model = model
-        self.client = Anthropic(api_key=api_key)
+
+        if os.environ.get("NEUROSCOPE_LLM_MODE") == STUB:
+            self.client = get_client(api_key, os.environ.get("NEUROSCOPE_STUB_URL", DEFAULT_STUB_URL))
+        else:
+            self.client = get_client(api_key)
+
+        self.transport = transport or make_transport(self.client)
+        self.budget = budget or TokenBudget.from_env(LEDGER)
+
+    def create(self, **params):
+
+        if self.budget is not None:
+            params = self.budget.enforce(params)
+
+        with span(f"llm.{type(self).__name__}", model=params.get("model")) as llm_span:
+            response = self.transport.create(**params)
+
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                llm_span.set(
+                    input_tokens=usage.input_tokens,
+                    output_tokens=usage.output_tokens,
+                    cache_creation_input_tokens=usage.cache_creation_input_tokens or 0,
+                    cache_read_input_tokens=usage.cache_read_input_tokens or 0
+                )
+
+        return response
+
+    def complete(self, params):
+        return AgentResult.from_response(self.create(**params), type(self).__name__)
 
     def call(self, content, images = None):
         if images:
@@ -15,9 +53,9 @@ class BaseClaudeAgent:
         else:
             content_block = content
         
-        response = self.client.messages.create(
+        response = self.create(
             model=self.model,
             max_tokens=1024,
             messages=[{"role": "user", "content": content_block}]
         )
-        return response.content[0].text.strip()
+        return AgentResult.from_response(response, type(self).__name__).strip()
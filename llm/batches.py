@@ -0,0 +1,132 @@
+import time
+from llm.scheduler import get_scheduler
+from llm.usage import LEDGER, AgentResult
+from llm.videoanalyze import single_request_frames
+from utils.tracing import case
+
+# Message Batches are billed at half the per-request price
+BATCH_DISCOUNT = 0.5
+
+class BatchRequestError(Exception):
+    pass
+
+class MessageBatchJob:
+
+    def __init__(self, client, poll_interval=30.0, timeout=None, scheduler=None):
+
+        self.client = client
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Batch calls go through the scheduler's retries and honour its pauses, like every other API call
+        self.scheduler = scheduler or get_scheduler()
+
+    def submit(self, requests):
+
+        batch = self.scheduler.retry(lambda: self.client.messages.batches.create(
+            requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+        ))
+        return batch.id
+
+    def wait(self, batch_id):
+
+        start = time.monotonic()
+        while True:
+
+            batch = self.scheduler.retry(lambda: self.client.messages.batches.retrieve(batch_id))
+            if batch.processing_status == "ended":
+                return batch
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise TimeoutError(f"Message batch {batch_id} did not finish within {self.timeout} seconds")
+
+            time.sleep(self.poll_interval)
+
+    def results(self, batch_id):
+
+        results = {}
+        for item in self.scheduler.retry(lambda: list(self.client.messages.batches.results(batch_id))):
+            if item.result.type == "succeeded":
+                results[item.custom_id] = item.result.message
+            else:
+                error = getattr(item.result, "error", None)
+                results[item.custom_id] = BatchRequestError(f"{item.result.type}: {error}")
+        return results
+
+    def run(self, requests):
+
+        if not requests:
+            return {}
+
+        batch_id = self.submit(requests)
+        self.wait(batch_id)
+        return self.results(batch_id)
+
+def prepare(agent, case_id, params):
+
+    # Batched requests skip BaseClaudeAgent.create, so apply its budget here, within the case so per-case limits see its usage
+    if agent.budget is not None:
+        with case(case_id):
+            params = agent.budget.enforce(params)
+    return params
+
+def collect(agent, case_id, message):
+
+    if isinstance(message, Exception):
+        raise message
+
+    result = AgentResult.from_response(message, type(agent).__name__)
+    LEDGER.record(case_id, type(agent).__name__, result.model, result.usage, 0.0, BATCH_DISCOUNT)
+    return result
+
+def batch_diagnose(agents, cases, mcp_context, job=None):
+
+    # cases: dicts with case_id, age, history, images and transcript
+    job = job or MessageBatchJob(agents.diagnosis.client)
+    modality_agents = (
+        ("history_analysis", agents.history, lambda patient: (patient["history"],)),
+        ("video_analysis", agents.vision, lambda patient: (single_request_frames(patient["images"]),)),
+        ("audio_analysis", agents.audio, lambda patient: (patient["transcript"],)),
+    )
+
+    # custom_id only allows [a-zA-Z0-9_-], so requests are keyed by position rather than case ID
+    requests = {}
+    results = []
+    for index, patient in enumerate(cases):
+        results.append({"case_id": patient["case_id"], "age": patient["age"], "status": "ok"})
+        # A case joins the batch only once all its modalities are prepared, so a failed case is never billed
+        case_requests = {}
+        try:
+            for key, agent, arguments in modality_agents:
+                case_requests[f"case-{index}-{key}"] = prepare(agent, patient["case_id"], agent.build_request(*arguments(patient)))
+        except Exception as error:
+            results[index].update(status="error", error=f"{type(error).__name__}: {error}")
+        else:
+            requests.update(case_requests)
+
+    messages = job.run(requests)
+
+    diagnosis_requests = {}
+    for index, patient in enumerate(cases):
+        result = results[index]
+        if result["status"] != "ok":
+            continue
+        try:
+            for key, agent, _ in modality_agents:
+                result[key] = collect(agent, patient["case_id"], messages[f"case-{index}-{key}"])
+            diagnosis_requests[f"case-{index}-diagnosis"] = prepare(agents.diagnosis, patient["case_id"], agents.diagnosis.build_request(
+                patient["age"], result["history_analysis"], result["video_analysis"], result["audio_analysis"], mcp_context
+            ))
+        except Exception as error:
+            result.update(status="error", error=f"{type(error).__name__}: {error}")
+
+    diagnosis_messages = job.run(diagnosis_requests)
+
+    for index, patient in enumerate(cases):
+        result = results[index]
+        if f"case-{index}-diagnosis" in diagnosis_requests:
+            try:
+                result["diagnosis"] = collect(agents.diagnosis, patient["case_id"], diagnosis_messages[f"case-{index}-diagnosis"])
+            except Exception as error:
+                result.update(status="error", error=f"{type(error).__name__}: {error}")
+        result["usage"] = LEDGER.pop(patient["case_id"])
+
+    return results
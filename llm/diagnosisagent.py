@@ -1,10 +1,31 @@
 from llm.baseagent import BaseClaudeAgent
+from llm.findings import Finding, parse_findings, compact_findings
 from utils.DSM5MCP import DSM5MCPServer
 
+def summarize_analysis(analysis, modality):
+
+    # Only Unusual findings are forwarded; the raw text is kept when it doesn't follow the agent format
+    if isinstance(analysis, str):
+        findings = parse_findings(analysis, modality)
+        if not findings:
+            return analysis
+    else:
+        findings = [finding for finding in analysis if isinstance(finding, Finding)]
+
+    return compact_findings(findings)
+
 class DiagnosisAgent(BaseClaudeAgent):
 
     def analyze(self, age, history_analysis, video_analysis, audio_analysis, mcp_context):
 
+        return self.complete(self.build_request(age, history_analysis, video_analysis, audio_analysis, mcp_context))
+
+    def build_request(self, age, history_analysis, video_analysis, audio_analysis, mcp_context):
+
+        history_analysis = summarize_analysis(history_analysis, "history")
+        video_analysis = summarize_analysis(video_analysis, "vision")
+        audio_analysis = summarize_analysis(audio_analysis, "audio")
+
         prompt = f"""You are a clinical reasoning agent that uses given evaluations from 3 other Agents to determine how likely it is for this patient to have Autism Spectrum Disorders.
 
                 Your task is to compare the information inputted by the agents with the DSM-5 MCP and determine the likelihood of the patient having ASD, as well as comorbities.
@@ -13,7 +34,7 @@ class DiagnosisAgent(BaseClaudeAgent):
 
                 Support your conlcusion with a thorough explanation using commonalities between patient and database features as well as background evidence (Cite DSM-5 and outside sources).
 
-                Patient Data:
+                Patient Data (only features the agents flagged as Unusual are listed; all other assessed features were Normal or had No Data):
 
                     Age: {age}
 
@@ -41,13 +62,60 @@ class DiagnosisAgent(BaseClaudeAgent):
         
         message_content = [{"type": "text", "text": prompt}]
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=1024,
-            messages=[{
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
                 "role": "user",
                 "content": message_content
             }]
-        )
+        }
+
+    def update(self, age, previous_diagnosis, changes, mcp_context):
+
+        return self.complete(self.build_update_request(age, previous_diagnosis, changes, mcp_context))
+
+    def build_update_request(self, age, previous_diagnosis, changes, mcp_context):
+
+        prompt = f"""You are a clinical reasoning agent that updates a previous Autism Spectrum Disorder assessment for a returning patient.
+
+                The previous assessment is below, followed by only the findings that changed since that visit (feature (modality): previous status -> current status). Findings that are not listed did not change.
+
+                Your task is to revise the previous conclusion in light of these changes, using the DSM-5 MCP. Keep what still holds, explain what the changes mean for the likelihood of ASD and comorbidities, and note whether the patient's features are typical at the current age.
+
+                Age: {age}
+
+                Previous Assessment:
+
+                    {previous_diagnosis}
+
+                Changed Findings:
+
+                    {changes}
+
+                DSM-5 MCP:
+
+                    {mcp_context}
+
+                Your output must follow this exact format (Do not address yourself as an agent. Begin with the first line below):
+
+                    (Nothing before this) It is... (likelihood) that you have an Autism Spectrum Disorder.
+
+                    Possible comorbidities include: (comorbidity): (likelihood)...
 
-        return response.content[0].text
+                    Changes since the previous visit: ...
+
+                    This is because...
+
+                    References: 
+
+                    ..."""
+
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}]
+            }]
+        }
@@ -0,0 +1,196 @@
+import re
+
+NORMAL = "Normal"
+UNUSUAL = "Unusual"
+NO_DATA = "No Data"
+
+STATUSES = (UNUSUAL, NO_DATA, NORMAL)
+
+_LINE = re.compile(r"^[\s\-\*•\.]*(?P<feature>[^:\[\]]+?)\s*:\s*\[?\s*(?P<value>.*?)\s*\]?\s*$")
+_STATUS = re.compile(r"^(?P<status>normal|unusual|no data)\b\s*[,:\-–—]?\s*(?P<explanation>.*)$", re.IGNORECASE)
+
+class Finding:
+
+    __slots__ = ("feature", "modality", "status", "explanation")
+
+    def __init__(self, feature, modality, status, explanation=""):
+
+        self.feature = feature
+        self.modality = modality
+        self.status = status
+        self.explanation = explanation
+
+    @property
+    def unusual(self):
+        return self.status == UNUSUAL
+
+    def to_dict(self):
+        return {
+            "feature": self.feature,
+            "modality": self.modality,
+            "status": self.status,
+            "explanation": self.explanation
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["feature"], data["modality"], data["status"], data.get("explanation", ""))
+
+    def __eq__(self, other):
+        if not isinstance(other, Finding):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Finding({self.modality!r}, {self.feature!r}, {self.status!r}, {self.explanation!r})"
+
+def _normalize_status(raw):
+
+    for status in STATUSES:
+        if raw.lower() == status.lower():
+            return status
+    return None
+
+def parse_findings(text, modality):
+
+    findings = []
+
+    for raw_line in text.splitlines():
+
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        match = _LINE.match(line)
+        status_match = _STATUS.match(match.group("value")) if match else None
+
+        if match is None:
+            # Bare "...[Unusual, explanation]" entries listed under Additional Mentions
+            status_match = _STATUS.match(line.lstrip(" .-*•[").rstrip("] "))
+            if status_match is not None:
+                status = _normalize_status(status_match.group("status"))
+                findings.append(Finding("Additional Mention", modality, status, status_match.group("explanation").strip()))
+                continue
+
+        if status_match is None:
+            # Explanations that wrap onto a second line belong to the previous Unusual finding
+            if findings and findings[-1].unusual and not line.endswith(":"):
+                findings[-1].explanation = f"{findings[-1].explanation} {line.lstrip('.').rstrip(']').strip()}".strip()
+            continue
+
+        feature = match.group("feature").strip().strip("*").strip()
+        status = _normalize_status(status_match.group("status"))
+        explanation = status_match.group("explanation").strip().rstrip("]").strip()
+
+        findings.append(Finding(feature, modality, status, explanation))
+
+    return findings
+
+def unusual_findings(findings):
+    return [finding for finding in findings if finding.unusual]
+
+def compact_findings(findings):
+
+    lines = []
+    for finding in unusual_findings(findings):
+        if finding.explanation:
+            lines.append(f"- {finding.feature}: {finding.explanation}")
+        else:
+            lines.append(f"- {finding.feature}")
+
+    if not lines:
+        return "No unusual findings."
+    return "\n".join(lines)
+
+def as_patient_data(findings):
+
+    patient_data = {}
+    for finding in unusual_findings(findings):
+        key = finding.feature
+        if key in patient_data:
+            key = f"{finding.feature} ({finding.modality})"
+        if key in patient_data:
+            key = f"{key} {len(patient_data)}"
+        patient_data[key] = finding.explanation or finding.status
+    return patient_data
+
+def merge_findings(finding_lists):
+
+    # Per feature, Unusual beats Normal beats No Data; Unusual explanations from every source are kept
+    rank = {UNUSUAL: 2, NORMAL: 1, NO_DATA: 0}
+    merged = {}
+    mentions = []
+
+    for findings in finding_lists:
+        for finding in findings:
+
+            if finding.feature == "Additional Mention":
+                if finding.unusual and all(finding != mention for mention in mentions):
+                    mentions.append(Finding(finding.feature, finding.modality, finding.status, finding.explanation))
+                continue
+
+            key = finding.feature.lower()
+            current = merged.get(key)
+            if current is None or rank[finding.status] > rank[current.status]:
+                merged[key] = Finding(finding.feature, finding.modality, finding.status, finding.explanation if finding.unusual else "")
+            elif finding.unusual and finding.explanation and finding.explanation not in current.explanation:
+                current.explanation = f"{current.explanation}; {finding.explanation}" if current.explanation else finding.explanation
+
+    return list(merged.values()) + mentions
+
+def format_findings(findings):
+
+    lines = []
+    mentions = []
+    for finding in findings:
+        value = f"{finding.status}, {finding.explanation}" if finding.unusual and finding.explanation else finding.status
+        if finding.feature == "Additional Mention":
+            mentions.append(f"...[{value}]")
+        else:
+            lines.append(f"{finding.feature}: [{value}]")
+
+    lines.append("")
+    lines.append("Additional Mentions:")
+    lines.extend(mentions)
+    return "\n".join(lines)
+
+def update_findings(previous, updates):
+
+    # Newer findings replace older ones for the features they assess; features they don't mention carry over
+    merged = {finding.feature.lower(): finding for finding in previous if finding.feature != "Additional Mention"}
+    mentions = [finding for finding in previous if finding.feature == "Additional Mention"]
+
+    for finding in updates:
+        if finding.feature == "Additional Mention":
+            if finding.unusual and all(finding != mention for mention in mentions):
+                mentions.append(finding)
+        elif finding.status != NO_DATA or finding.feature.lower() not in merged:
+            merged[finding.feature.lower()] = finding
+
+    return list(merged.values()) + mentions
+
+def diff_findings(previous, current):
+
+    before = {(finding.modality, finding.feature.lower()): finding for finding in previous if finding.feature != "Additional Mention"}
+    changes = []
+    for finding in current:
+        if finding.feature == "Additional Mention":
+            continue
+        old = before.get((finding.modality, finding.feature.lower()))
+        old_status = old.status if old is not None else NO_DATA
+        # Explanations are reworded on every run, so only a change of status counts
+        if old_status != finding.status:
+            changes.append((finding, old_status))
+    return changes
+
+def format_changes(changes):
+
+    if not changes:
+        return "No findings changed."
+    lines = []
+    for finding, old_status in changes:
+        line = f"- {finding.feature} ({finding.modality}): {old_status} -> {finding.status}"
+        if finding.unusual and finding.explanation:
+            line += f", {finding.explanation}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -1,18 +1,97 @@
-from anthropic import Anthropic
-import streamlit as st
-import cv2
-from PIL import Image
-import base64
+import contextvars
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from llm.baseagent import BaseClaudeAgent
+from llm.findings import parse_findings, merge_findings, format_findings
+from llm.usage import AgentResult
+
+# Histories longer than this are split and analyzed in parallel, then merged locally
+CHUNK_CHARS = int(os.environ.get("NEUROSCOPE_HISTORY_CHUNK_CHARS", 24000))
+CHUNK_CONCURRENCY = int(os.environ.get("NEUROSCOPE_HISTORY_CONCURRENCY", 4))
+
+_DOCUMENT_BREAK = re.compile(r"\f|\n[ \t]*(?:-{3,}|={3,}|\*{3,})[ \t]*\n")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+
+def pack(pieces, max_chars, separator):
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def split_history(history, max_chars=CHUNK_CHARS):
+
+    # Split at document breaks first, then paragraphs, then lines, so a note is only cut when it alone is too long
+    chunks = []
+    for document in _DOCUMENT_BREAK.split(history):
+        document = document.strip()
+        if not document:
+            continue
+        if len(document) <= max_chars:
+            chunks.append(document)
+            continue
+
+        paragraphs = []
+        for paragraph in _PARAGRAPH_BREAK.split(document):
+            if len(paragraph) <= max_chars:
+                paragraphs.append(paragraph.strip())
+            else:
+                lines = [line[start:start + max_chars] for line in paragraph.splitlines() for start in range(0, max(len(line), 1), max_chars)]
+                paragraphs.extend(pack(lines, max_chars, "\n"))
+        chunks.extend(pack([paragraph for paragraph in paragraphs if paragraph], max_chars, "\n\n"))
+
+    return pack(chunks, max_chars, "\n\n")
+
+def history_delta(previous, current):
+
+    # Paragraphs already in the previous record are dropped, so a full updated history and notes-only input both work
+    seen = {" ".join(paragraph.split()) for paragraph in _PARAGRAPH_BREAK.split(previous or "")}
+    new = [paragraph.strip() for paragraph in _PARAGRAPH_BREAK.split(current) if " ".join(paragraph.split()) not in seen]
+    return "\n\n".join(paragraph for paragraph in new if paragraph)
 
 class HistoryAgent(BaseClaudeAgent):
     
     def analyze(self, history: str):
+
+        if len(history) > CHUNK_CHARS:
+            return self.analyze_chunks(split_history(history))
+        return self.complete(self.build_request(history))
+
+    def analyze_chunks(self, chunks, concurrency=CHUNK_CONCURRENCY):
+
+        if len(chunks) == 1:
+            return self.complete(self.build_request(chunks[0]))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.complete, self.build_request(chunk, (index + 1, len(chunks))))
+                for index, chunk in enumerate(chunks)
+            ]
+            results = [future.result() for future in futures]
+
+        # Merging is deterministic and local, so no extra call has to re-read the whole history
+        merged = merge_findings(parse_findings(result, "history") for result in results)
+        text = format_findings(merged) if merged else "\n\n".join(result.strip() for result in results)
+        usage = sum((result.usage for result in results[1:]), results[0].usage)
+        return AgentResult(text, usage, results[0].agent, results[0].model)
+
+    def build_request(self, history: str, part=None):
+
+        scope = "The user will input all historical observations as one unstructured text block."
+        if part is not None:
+            scope = f"The user's historical observations are too long for one pass; this is part {part[0]} of {part[1]}. Assess only what this part mentions and use \"No Data\" for anything it does not."
         
         prompt = f"""You are a clinical reasoning agent that evaluates a patient's health, behavioral, developmental, and social history to identify abnormal features.
 
-                The user will input all historical observations as one unstructured text block.
+                {scope}
 
                 Your task is to extract relevant health history features that don't correlate with ideal human features and assess each for clinical relevance.
 
@@ -63,13 +142,11 @@ class HistoryAgent(BaseClaudeAgent):
         
         message_content = [{"type": "text", "text": prompt}]
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=1024,
-            messages=[{
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
                 "role": "user",
                 "content": message_content
             }]
-        )
-
-        return response.content[0].text
+        }
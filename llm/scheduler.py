@@ -0,0 +1,315 @@
+import contextlib
+import contextvars
+import functools
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from utils.tracing import current_span
+from utils.tenants import get_tenant, tenant_quota
+from utils.metrics import add_sampler, set_gauge
+
+INTERACTIVE = 0
+BATCH = 1
+
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504, 529)
+RETRYABLE_ERRORS = ("APIConnectionError", "APITimeoutError")
+
+_priority = contextvars.ContextVar("neuroscope_llm_priority", default=INTERACTIVE)
+
+@contextlib.contextmanager
+def priority(level):
+
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
+
+def env_number(name, default=0):
+    return float(os.environ.get(name) or default)
+
+class TokenBucket:
+
+    def __init__(self, per_minute):
+
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+
+        self.refill(now)
+        # A request bigger than a whole minute's allowance only waits for a full bucket
+        needed = min(amount, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RequestScheduler:
+
+    def __init__(self, requests_per_minute=0, input_tokens_per_minute=0, output_tokens_per_minute=0,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, hedge_after=0.0, hedge_workers=16):
+
+        self.buckets = {}
+        if requests_per_minute:
+            self.buckets["requests"] = TokenBucket(requests_per_minute)
+        if input_tokens_per_minute:
+            self.buckets["input_tokens"] = TokenBucket(input_tokens_per_minute)
+        if output_tokens_per_minute:
+            self.buckets["output_tokens"] = TokenBucket(output_tokens_per_minute)
+
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.paused_until = 0.0
+        self.tenant_buckets = {}
+        self.tenant_virtual = {}
+        self.virtual_now = 0.0
+        # Only the second copies run here, so the pool bounds extra load rather than the number of calls
+        self.hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="neuroscope-hedge") if hedge_after else None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            env_number("NEUROSCOPE_LLM_RPM"),
+            env_number("NEUROSCOPE_LLM_INPUT_TPM"),
+            env_number("NEUROSCOPE_LLM_OUTPUT_TPM"),
+            int(env_number("NEUROSCOPE_LLM_MAX_RETRIES", 6)),
+            hedge_after=env_number("NEUROSCOPE_LLM_HEDGE_AFTER"),
+            hedge_workers=int(env_number("NEUROSCOPE_LLM_HEDGE_WORKERS", 16))
+        )
+
+    def tenant_bucket(self, name):
+
+        per_minute = tenant_quota(name)["tokens_per_minute"]
+        if per_minute and name not in self.tenant_buckets:
+            self.tenant_buckets[name] = TokenBucket(per_minute)
+        return self.tenant_buckets.get(name)
+
+    def next_ticket(self, now):
+
+        # The first ticket whose tenant is within its own token rate; a throttled tenant doesn't hold up the others
+        tenant_delays = []
+        for ticket in sorted(self.waiting):
+            bucket = self.tenant_buckets.get(ticket[3])
+            delay = bucket.wait_time(ticket[4], now) if bucket is not None else 0.0
+            if delay <= 0:
+                return ticket, 0.0
+            tenant_delays.append(delay)
+        return None, min(tenant_delays, default=0.0)
+
+    def acquire(self, costs, level=None):
+
+        # Waiters are served by (priority, tenant virtual time, arrival): batch work never jumps an interactive
+        # request, and within a priority each tenant gets its weighted share of tokens however much it has queued
+        level = _priority.get() if level is None else level
+        name = get_tenant()
+        tokens = costs.get("input_tokens", 0) + costs.get("output_tokens", 0)
+        waited = time.monotonic()
+
+        with self.condition:
+            bucket = self.tenant_bucket(name)
+            start = max(self.virtual_now, self.tenant_virtual.get(name, 0.0))
+            self.tenant_virtual[name] = start + max(tokens, 1) / tenant_quota(name)["weight"]
+            ticket = (level, start, next(self.sequence), name, tokens)
+            self.waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = self.paused_until - now
+                    head, tenant_delay = self.next_ticket(now)
+                    if head == ticket:
+                        delay = max([delay] + [global_bucket.wait_time(costs.get(key, 0), now) for key, global_bucket in self.buckets.items()])
+                        if delay <= 0:
+                            break
+                    elif head is None:
+                        delay = max(delay, tenant_delay)
+                    self.condition.wait(timeout=delay if delay > 0 else None)
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+
+            for key, global_bucket in self.buckets.items():
+                global_bucket.take(costs.get(key, 0))
+            if bucket is not None:
+                bucket.take(tokens)
+            self.virtual_now = max(self.virtual_now, start)
+
+        return time.monotonic() - waited
+
+    def release(self, reserved, used, name=None):
+
+        # Output tokens are reserved at max_tokens and the unused part is returned once the real count is known
+        if used is None:
+            return
+        with self.condition:
+            for bucket in (self.buckets.get("output_tokens"), self.tenant_buckets.get(name or get_tenant())):
+                if bucket is not None:
+                    bucket.give_back(max(0, reserved - used))
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+
+        # A retry-after from the API applies to every caller, not just the one that got it
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def backoff(self, attempt, error):
+
+        retry_after = retry_after_seconds(error)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            self.pause(retry_after)
+            delay = max(delay, retry_after)
+        return delay
+
+    def run(self, func, params):
+
+        costs = request_costs(params)
+        response = self.retry(lambda: self.hedged(func, params, costs) if self.hedge_pool else func(**params), costs)
+        usage = getattr(response, "usage", None)
+        self.release(costs.get("output_tokens", 0), getattr(usage, "output_tokens", None))
+        return response
+
+    def retry(self, call, costs=None):
+
+        # Calls that aren't model requests, such as Message Batches submission and polling, pass no costs:
+        # they take nothing from the rate limits but still wait out a pause and retry with backoff
+        costs = costs or {}
+        waited = 0.0
+        attempt = 0
+        while True:
+            waited += self.acquire(costs)
+            try:
+                response = call()
+            except Exception as error:
+                if not retryable(error) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, error)
+                attempt += 1
+                current_span().set(retries=attempt, last_error=type(error).__name__)
+                time.sleep(delay)
+                continue
+
+            current_span().set(queued_s=round(waited, 3), retries=attempt)
+            return response
+
+    def hedged(self, func, params, costs):
+
+        # The primary starts on its own thread at once, so it never waits for a pool worker and that wait can't
+        # trigger a hedge; the caller only waits, since a blocking SDK call on its thread couldn't be abandoned
+        primary = start_thread(func, params)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        # A second copy goes out; whichever finishes first wins and the other is settled when it finishes
+        self.acquire(costs)
+        hedge = self.hedge_pool.submit(contextvars.copy_context().run, func, **params)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = primary if primary in done else hedge
+        loser = hedge if winner is primary else primary
+        if winner.exception() is not None:
+            winner, loser = loser, winner
+
+        llm_span = current_span()
+        name = get_tenant()
+        loser.add_done_callback(lambda future: self.settle_loser(future, costs.get("output_tokens", 0), llm_span, name))
+        llm_span.set(hedged=True, hedge_won=winner is hedge)
+        return winner.result()
+
+    def settle_loser(self, future, reserved, llm_span, name):
+
+        from llm.usage import LEDGER, Usage
+        from utils.metrics import inc
+
+        if future.cancelled() or future.exception() is not None:
+            # A copy that failed produced no output, so its whole reservation goes back
+            self.release(reserved, 0, name)
+            return
+        response = future.result()
+        usage = Usage.from_response(response)
+        self.release(reserved, usage.output_tokens, name)
+
+        # The unused copy is still billed, so its tokens count against the case and in the metrics
+        agent = llm_span.name[len("llm."):]
+        for kind in ("input", "output", "cache_creation_input", "cache_read_input"):
+            if getattr(usage, f"{kind}_tokens"):
+                inc("neuroscope_llm_tokens_total", getattr(usage, f"{kind}_tokens"), agent=agent, kind=kind)
+        if LEDGER.is_open(llm_span.case_id):
+            LEDGER.record(llm_span.case_id, agent, getattr(response, "model", None), usage, 0.0)
+
+def start_thread(func, params):
+
+    future = Future()
+
+    def target():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(**params))
+            except BaseException as error:
+                future.set_exception(error)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True, name="neuroscope-llm").start()
+    return future
+
+def request_costs(params):
+
+    from llm.usage import estimate_request_tokens
+
+    text_tokens, image_tokens = estimate_request_tokens(params)
+    return {"requests": 1, "input_tokens": text_tokens + image_tokens, "output_tokens": params.get("max_tokens", 0)}
+
+def retryable(error):
+
+    status = getattr(error, "status_code", None)
+    return status in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+def retry_after_seconds(error):
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+class ScheduledTransport:
+
+    def __init__(self, inner, scheduler):
+
+        self.inner = inner
+        self.scheduler = scheduler
+
+    def create(self, **params):
+        return self.scheduler.run(self.inner.create, params)
+
+@functools.lru_cache(maxsize=1)
+def get_scheduler():
+    # One scheduler per process so every agent draws from the same rate limits
+    scheduler = RequestScheduler.from_env()
+    add_sampler(lambda: set_gauge("neuroscope_llm_waiting", len(scheduler.waiting)))
+    return scheduler
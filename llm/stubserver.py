@@ -0,0 +1,184 @@
+import argparse
+import collections
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm.transport import LATENCY_PROFILES, DEFAULT_REPLAY_DIR, ReplayStore, ReplayTransport, ReplayMissError
+
+def timestamp(moment=None):
+    return (moment or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class StubBatch:
+
+    def __init__(self, requests, base_url):
+
+        self.id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        self.requests = requests
+        self.base_url = base_url
+        self.created_at = datetime.now(timezone.utc)
+        self.ended_at = None
+        self.results = []
+        self.counts = {"processing": len(requests), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+
+    def process(self, transport):
+
+        for request in self.requests:
+            try:
+                message = transport.create(**request["params"])
+                result = {"type": "succeeded", "message": message.model_dump(mode="json")}
+                self.counts["succeeded"] += 1
+            except Exception as error:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "not_found_error", "message": str(error)}}}
+                self.counts["errored"] += 1
+            self.counts["processing"] -= 1
+            self.results.append({"custom_id": request["custom_id"], "result": result})
+
+        self.ended_at = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": "message_batch",
+            "processing_status": "ended" if self.ended_at else "in_progress",
+            "request_counts": dict(self.counts),
+            "created_at": timestamp(self.created_at),
+            "expires_at": timestamp(self.created_at + timedelta(days=1)),
+            "ended_at": timestamp(self.ended_at) if self.ended_at else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"{self.base_url}/v1/messages/batches/{self.id}/results" if self.ended_at else None
+        }
+
+class FaultInjector:
+
+    def __init__(self, requests_per_minute=0, overload_rate=0.0):
+
+        self.requests_per_minute = requests_per_minute
+        self.overload_rate = overload_rate
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+
+    def check(self):
+
+        # Returns (status, error type, retry-after seconds) for a request that should fail, else None
+        if self.overload_rate and random.random() < self.overload_rate:
+            return 529, "overloaded_error", None
+        if not self.requests_per_minute:
+            return None
+
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.requests_per_minute:
+                return 429, "rate_limit_error", math.ceil(60 - (now - self.recent[0]))
+            self.recent.append(now)
+        return None
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload, headers=None):
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self, message):
+        self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": message}})
+
+    def read_json(self):
+
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+
+        path = self.path.split("?")[0]
+
+        if path == "/v1/messages":
+            params = self.read_json()
+            fault = self.server.faults.check()
+            if fault is not None:
+                status, error_type, retry_after = fault
+                headers = {"retry-after": str(retry_after)} if retry_after is not None else None
+                self.send_json(status, {"type": "error", "error": {"type": error_type, "message": "Injected by the stub server"}}, headers)
+                return
+            try:
+                message = self.server.transport.create(**params)
+            except ReplayMissError as error:
+                self.send_not_found(str(error))
+                return
+            self.send_json(200, message.model_dump(mode="json"))
+
+        elif path == "/v1/messages/batches":
+            batch = StubBatch(self.read_json()["requests"], f"http://{self.server.server_address[0]}:{self.server.server_address[1]}")
+            self.server.batches[batch.id] = batch
+            threading.Thread(target=batch.process, args=(self.server.transport,), daemon=True).start()
+            self.send_json(200, batch.to_dict())
+
+        else:
+            self.send_not_found(path)
+
+    def do_GET(self):
+
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4 or parts[3] not in self.server.batches:
+            self.send_not_found(self.path)
+            return
+
+        batch = self.server.batches[parts[3]]
+        if len(parts) == 4:
+            self.send_json(200, batch.to_dict())
+            return
+
+        if parts[4:] == ["results"] and batch.ended_at:
+            body = "".join(json.dumps(result) + "\n" for result in batch.results).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-jsonl")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_not_found(self.path)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(host="127.0.0.1", port=8765, store_dir=DEFAULT_REPLAY_DIR, profile="instant", synthesize_misses=False,
+                requests_per_minute=0, overload_rate=0.0):
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.transport = ReplayTransport(ReplayStore(store_dir), LATENCY_PROFILES[profile], synthesize_misses)
+    server.batches = {}
+    server.faults = FaultInjector(requests_per_minute, overload_rate)
+    return server
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve recorded Claude responses over the Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--store", default=DEFAULT_REPLAY_DIR)
+    parser.add_argument("--profile", default="instant", choices=sorted(LATENCY_PROFILES))
+    parser.add_argument("--synthesize-misses", action="store_true")
+    parser.add_argument("--rpm", type=int, default=0, help="Answer 429 with retry-after beyond this many requests per minute")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Fraction of requests answered with 529 overloaded")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.store, args.profile, args.synthesize_misses, args.rpm, args.overload_rate)
+    print(f"Stub Messages API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+STUB = "stub"
+
+DEFAULT_REPLAY_DIR = ".replay"
+DEFAULT_STUB_URL = "http://127.0.0.1:8765"
+
+# Keys that don't change what the model answers and shouldn't split the replay cache
+_IGNORED_KEYS = {"metadata", "stream", "timeout", "extra_headers"}
+
+class ReplayMissError(KeyError):
+    pass
+
+class LatencyProfile:
+
+    def __init__(self, base_latency=0.0, input_tokens_per_sec=None, output_tokens_per_sec=None, jitter=0.0):
+
+        self.base_latency = base_latency
+        self.input_tokens_per_sec = input_tokens_per_sec
+        self.output_tokens_per_sec = output_tokens_per_sec
+        self.jitter = jitter
+
+    def delay(self, input_tokens, output_tokens):
+
+        seconds = self.base_latency
+        if self.input_tokens_per_sec:
+            seconds += input_tokens / self.input_tokens_per_sec
+        if self.output_tokens_per_sec:
+            seconds += output_tokens / self.output_tokens_per_sec
+        if self.jitter:
+            seconds *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(seconds, 0.0)
+
+LATENCY_PROFILES = {
+    "instant": LatencyProfile(),
+    "opus": LatencyProfile(base_latency=1.5, input_tokens_per_sec=20000, output_tokens_per_sec=30, jitter=0.2),
+    "sonnet": LatencyProfile(base_latency=0.8, input_tokens_per_sec=40000, output_tokens_per_sec=70, jitter=0.2),
+}
+
+def _normalize(value):
+
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if key not in _IGNORED_KEYS}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+def request_key(params):
+
+    normalized = json.dumps(_normalize(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def to_message(data):
+
+    from anthropic.types import Message
+    return Message.model_validate(data)
+
+class ReplayStore:
+
+    def __init__(self, directory=DEFAULT_REPLAY_DIR):
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, params, response):
+
+        # Write then rename so concurrent readers never see a partial record
+        temp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"request": _normalize(params), "response": response}, file, indent=2)
+        os.replace(temp_path, self.path(key))
+
+class LiveTransport:
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **params):
+        return self.client.messages.create(**params)
+
+class RecordTransport(LiveTransport):
+
+    def __init__(self, client, store):
+
+        super().__init__(client)
+        self.store = store
+
+    def create(self, **params):
+
+        response = self.client.messages.create(**params)
+        self.store.put(request_key(params), params, response.model_dump(mode="json"))
+        return response
+
+class ReplayTransport:
+
+    def __init__(self, store, profile=None, synthesize_misses=False):
+
+        self.store = store
+        self.profile = profile or LATENCY_PROFILES["instant"]
+        self.synthesize_misses = synthesize_misses
+
+    def lookup(self, params):
+
+        key = request_key(params)
+        record = self.store.get(key)
+
+        if record is not None:
+            return record["response"]
+        if not self.synthesize_misses:
+            raise ReplayMissError(f"No recorded response for request {key}")
+        return self.synthesize(params, key)
+
+    def synthesize(self, params, key):
+
+        from llm.usage import estimate_request_tokens
+        text_tokens, image_tokens = estimate_request_tokens(params)
+        text = "Replay stub response."
+
+        return {
+            "id": f"msg_replay_{key[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": params.get("model", ""),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": text_tokens + image_tokens, "output_tokens": estimate_tokens(text)}
+        }
+
+    def create(self, **params):
+
+        response = self.lookup(params)
+        usage = response.get("usage", {})
+        time.sleep(self.profile.delay(usage.get("input_tokens", 0), usage.get("output_tokens", 0)))
+        return to_message(response)
+
+def make_transport(client, mode=None, scheduler=None):
+
+    from llm.scheduler import ScheduledTransport, get_scheduler
+
+    mode = mode or os.environ.get("NEUROSCOPE_LLM_MODE", LIVE)
+    store_dir = os.environ.get("NEUROSCOPE_REPLAY_DIR", DEFAULT_REPLAY_DIR)
+    scheduler = scheduler or get_scheduler()
+
+    # Retries move from the SDK to the scheduler, which also knows about rate limits and priorities
+    if client is not None:
+        client = client.with_options(max_retries=0, timeout=float(os.environ.get("NEUROSCOPE_LLM_TIMEOUT", 180)))
+
+    if mode == RECORD:
+        return ScheduledTransport(RecordTransport(client, ReplayStore(store_dir)), scheduler)
+    if mode == REPLAY:
+        profile = LATENCY_PROFILES[os.environ.get("NEUROSCOPE_LATENCY_PROFILE", "instant")]
+        synthesize = os.environ.get("NEUROSCOPE_REPLAY_SYNTHESIZE", "0") == "1"
+        return ScheduledTransport(ReplayTransport(ReplayStore(store_dir), profile, synthesize), scheduler)
+    if mode in (LIVE, STUB):
+        # Stub mode is a live client pointed at the local stub server (see BaseClaudeAgent)
+        return ScheduledTransport(LiveTransport(client), scheduler)
+
+    raise ValueError(f"Unknown LLM mode: {mode}")
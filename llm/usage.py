@@ -0,0 +1,295 @@
+import base64
+import io
+import json
+import os
+import threading
+from utils.tracing import add_listener, get_case_id
+
+# USD per million tokens: (input, output, cache write, cache read)
+PRICING = {
+    "opus": (15.0, 75.0, 18.75, 1.50),
+    "sonnet": (3.0, 15.0, 3.75, 0.30),
+    "haiku": (0.80, 4.0, 1.0, 0.08),
+}
+
+# Images are downscaled by the API so the long edge fits in this many pixels
+MAX_IMAGE_EDGE = 1568
+PIXELS_PER_TOKEN = 750
+MIN_IMAGE_EDGE = 200
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+class Usage:
+
+    __slots__ = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+    def __init__(self, input_tokens=0, output_tokens=0, cache_creation_input_tokens=0, cache_read_input_tokens=0):
+
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_creation_input_tokens = cache_creation_input_tokens
+        self.cache_read_input_tokens = cache_read_input_tokens
+
+    @classmethod
+    def from_response(cls, response):
+
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return cls()
+        return cls(
+            usage.input_tokens,
+            usage.output_tokens,
+            getattr(usage, "cache_creation_input_tokens", None) or 0,
+            getattr(usage, "cache_read_input_tokens", None) or 0
+        )
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __add__(self, other):
+        return Usage(*(getattr(self, name) + getattr(other, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return f"Usage({', '.join(f'{name}={getattr(self, name)}' for name in self.__slots__)})"
+
+class AgentResult(str):
+
+    # A str subclass so existing callers that treat agent output as text keep working
+    def __new__(cls, text, usage=None, agent=None, model=None):
+
+        result = super().__new__(cls, text)
+        result.usage = usage or Usage()
+        result.agent = agent
+        result.model = model
+        return result
+
+    @classmethod
+    def from_response(cls, response, agent=None):
+        return cls(response.content[0].text, Usage.from_response(response), agent, getattr(response, "model", None))
+
+    def strip(self, chars=None):
+        return AgentResult(super().strip(chars), self.usage, self.agent, self.model)
+
+    @property
+    def text(self):
+        return str(self)
+
+    @property
+    def cost(self):
+        return estimate_cost(self.model, self.usage)
+
+def model_pricing(model):
+
+    for family, prices in PRICING.items():
+        if family in (model or ""):
+            return prices
+    return PRICING["opus"]
+
+def estimate_cost(model, usage):
+
+    input_price, output_price, cache_write_price, cache_read_price = model_pricing(model)
+    return (
+        usage.input_tokens * input_price
+        + usage.output_tokens * output_price
+        + usage.cache_creation_input_tokens * cache_write_price
+        + usage.cache_read_input_tokens * cache_read_price
+    ) / 1e6
+
+def image_size(block):
+
+    from PIL import Image
+    data = base64.b64decode(block["source"]["data"])
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+def image_tokens(width, height):
+
+    scale = min(1.0, MAX_IMAGE_EDGE / max(width, height))
+    return int(width * scale * height * scale / PIXELS_PER_TOKEN)
+
+def iter_blocks(params):
+
+    for message in params.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            yield {"type": "text", "text": content}
+        else:
+            yield from content
+
+def estimate_request_tokens(params):
+
+    text_tokens = 0
+    picture_tokens = 0
+
+    for block in iter_blocks(params):
+        if block.get("type") == "image" and block.get("source", {}).get("type") == "base64":
+            picture_tokens += image_tokens(*image_size(block))
+        elif block.get("type") == "text":
+            text_tokens += len(block["text"]) // 4
+        else:
+            text_tokens += len(json.dumps(block)) // 4
+
+    system = params.get("system", "")
+    text_tokens += len(system if isinstance(system, str) else json.dumps(system)) // 4
+
+    return text_tokens, picture_tokens
+
+def downscale_image(block, scale):
+
+    from PIL import Image
+    data = base64.b64decode(block["source"]["data"])
+
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        effective_scale = min(1.0, MAX_IMAGE_EDGE / max(width, height)) * scale
+        new_width = max(MIN_IMAGE_EDGE, int(width * effective_scale))
+        resized = image.convert("RGB").resize((new_width, max(1, height * new_width // width)))
+
+    buffer = io.BytesIO()
+    resized.save(buffer, format="JPEG", quality=85)
+    return {
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/jpeg", "data": base64.b64encode(buffer.getvalue()).decode("utf-8")}
+    }
+
+def downscale_images(params, scale):
+
+    messages = []
+    for message in params.get("messages", []):
+        content = message.get("content", "")
+        if not isinstance(content, str):
+            content = [downscale_image(block, scale) if block.get("type") == "image" else block for block in content]
+        messages.append({**message, "content": content})
+    return {**params, "messages": messages}
+
+class TokenBudget:
+
+    def __init__(self, max_request_tokens=None, max_case_tokens=None, ledger=None):
+
+        self.max_request_tokens = max_request_tokens
+        self.max_case_tokens = max_case_tokens
+        self.ledger = ledger
+
+    @classmethod
+    def from_env(cls, ledger=None):
+
+        request_limit = os.environ.get("NEUROSCOPE_MAX_REQUEST_TOKENS")
+        case_limit = os.environ.get("NEUROSCOPE_MAX_CASE_TOKENS")
+        if not request_limit and not case_limit:
+            return None
+        return cls(int(request_limit) if request_limit else None, int(case_limit) if case_limit else None, ledger)
+
+    def limit(self):
+
+        limits = []
+        if self.max_request_tokens:
+            limits.append(self.max_request_tokens)
+        if self.max_case_tokens and self.ledger is not None:
+            limits.append(self.max_case_tokens - self.ledger.case_tokens(get_case_id()))
+        return min(limits) if limits else None
+
+    def enforce(self, params):
+
+        limit = self.limit()
+        if limit is None:
+            return params
+
+        text_tokens, picture_tokens = estimate_request_tokens(params)
+        estimate = text_tokens + picture_tokens + params.get("max_tokens", 0)
+        if estimate <= limit:
+            return params
+
+        # Images are the only part we can shrink without changing what the model is asked
+        available = limit - text_tokens - params.get("max_tokens", 0)
+        if picture_tokens and available > 0:
+            params = downscale_images(params, (available / picture_tokens) ** 0.5)
+            text_tokens, picture_tokens = estimate_request_tokens(params)
+            estimate = text_tokens + picture_tokens + params.get("max_tokens", 0)
+            if estimate <= limit:
+                return params
+
+        raise TokenBudgetExceeded(f"Request needs about {estimate} tokens but the budget allows {limit}")
+
+class CaseLedger:
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.cases = {}
+
+    def record(self, case_id, agent, model, usage, latency, discount=1.0):
+
+        # Calls outside a case have nobody to pop their entry, so they'd accumulate for the life of the process
+        if case_id is None:
+            return
+        with self.lock:
+            entry = self.cases.setdefault(case_id, {}).setdefault(agent, {
+                "calls": 0,
+                "usage": Usage(),
+                "cost": 0.0,
+                "latency": 0.0
+            })
+            entry["calls"] += 1
+            entry["usage"] = entry["usage"] + usage
+            entry["cost"] += estimate_cost(model, usage) * discount
+            entry["latency"] += latency
+
+    def record_span(self, span):
+
+        if not span.name.startswith("llm.") or "input_tokens" not in span.attributes:
+            return
+
+        attributes = span.attributes
+        usage = Usage(
+            attributes.get("input_tokens", 0),
+            attributes.get("output_tokens", 0),
+            attributes.get("cache_creation_input_tokens", 0),
+            attributes.get("cache_read_input_tokens", 0)
+        )
+        self.record(span.case_id, span.name[len("llm."):], attributes.get("model"), usage, span.duration)
+
+    def is_open(self, case_id):
+
+        with self.lock:
+            return case_id in self.cases
+
+    def case_tokens(self, case_id):
+
+        with self.lock:
+            return sum(entry["usage"].total_tokens for entry in self.cases.get(case_id, {}).values())
+
+    def summary(self, case_id):
+
+        with self.lock:
+            agents = {
+                agent: {
+                    "calls": entry["calls"],
+                    **entry["usage"].to_dict(),
+                    "cost_usd": round(entry["cost"], 6),
+                    "latency_s": round(entry["latency"], 3)
+                }
+                for agent, entry in self.cases.get(case_id, {}).items()
+            }
+
+        return {
+            "case_id": case_id,
+            "agents": agents,
+            "total_tokens": sum(entry["input_tokens"] + entry["output_tokens"] + entry["cache_creation_input_tokens"] + entry["cache_read_input_tokens"] for entry in agents.values()),
+            "total_cost_usd": round(sum(entry["cost_usd"] for entry in agents.values()), 6),
+            "total_latency_s": round(sum(entry["latency_s"] for entry in agents.values()), 3)
+        }
+
+    def pop(self, case_id):
+
+        summary = self.summary(case_id)
+        with self.lock:
+            self.cases.pop(case_id, None)
+        return summary
+
+LEDGER = CaseLedger()
+add_listener(LEDGER.record_span)
@@ -1,23 +1,22 @@
+import contextvars
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from llm.baseagent import BaseClaudeAgent
-from utils.image_utils import get_encoded_frames, extract_frames
+from llm.findings import NO_DATA, parse_findings
+from llm.usage import AgentResult
+from utils.image_utils import get_encoded_frames, extract_frames, get_video_duration, encode_frames, frame_budget, TILE_LAYOUT
+from utils.frame_hash import get_distinct_frames, DEDUPE_METHOD
 
-class VisionAgent(BaseClaudeAgent):
-    
-    def analyze(self, video_path):
-        
-        output_path = "C:\\Users\\1094828\\SCSP Hackathon\\frames"
-        raw_images = extract_frames(video_path, output_path)
-        images = get_encoded_frames(output_path)
-
-        prompt = f"""You are a clinical analysis agent that evaluates given frames sampled from a video of a patient conversating to identify unusual behaviors. 
-        
-                Your task is to identify unusual or abnormal behaviors of the patient that indicate non-ideal human behavior.
-                
-                Also compare the frames with each other to identify change of behaviors and expressions. 
-
-                The patient will always be on the right-hand side of the video.
+# Long-video mode: the timeline is split into windows analyzed in parallel, then merged by one reduce call
+WINDOW_SEC = float(os.environ.get("NEUROSCOPE_VISION_WINDOW_SEC", 0))
+MAX_WINDOWS = int(os.environ.get("NEUROSCOPE_VISION_MAX_WINDOWS", 12))
+FRAMES_PER_WINDOW = int(os.environ.get("NEUROSCOPE_VISION_FRAMES_PER_WINDOW", 6))
+WINDOW_CONCURRENCY = int(os.environ.get("NEUROSCOPE_VISION_CONCURRENCY", 4))
 
-                For each identified feature, return:
+OUTPUT_FORMAT = """For each identified feature, return:
 
                     "Normal" if it reflects typical behavior
 
@@ -46,15 +45,154 @@ class VisionAgent(BaseClaudeAgent):
                 Notes:
                     If behaviors are displayed that are not specified in the format above, address each of them under the "Additional Mentions" line."""
 
+SHEET_NOTE = ""
+if TILE_LAYOUT is not None:
+    SHEET_NOTE = "\n\n                Each image is a contact sheet of frames in time order, left to right then top to bottom, with the frame's timestamp in its top-left corner."
+
+def format_time(seconds):
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+def summarize_window(analysis):
+
+    # Normal findings stay in so the reduce step can see behavior change between windows
+    findings = [finding for finding in parse_findings(analysis, "vision") if finding.status != NO_DATA]
+    if not findings:
+        return analysis.strip()
+    return "\n".join(
+        f"- {finding.feature}: {finding.status}" + (f", {finding.explanation}" if finding.explanation else "")
+        for finding in findings
+    )
+
+def plan_windows(duration, window_sec=None, max_windows=MAX_WINDOWS):
+
+    window_sec = window_sec or WINDOW_SEC or 120
+    # Past max_windows the windows widen instead, so cost stays bounded for very long sessions
+    count = max(1, min(max_windows, math.ceil(duration / window_sec)))
+    length = duration / count if duration else window_sec
+    return [(index * length, (index + 1) * length) for index in range(count)]
+
+def extract_window_frames(video_path, work_dir, index, start, end, frames_per_window):
+
+    frames = frame_budget(frames_per_window)
+    interval = max((end - start) / frames, 0.1)
+
+    if DEDUPE_METHOD:
+        return get_distinct_frames(video_path, frames, interval, start, end)
+
+    frame_dir = os.path.join(work_dir, f"window_{index}")
+    os.makedirs(frame_dir)
+    extract_frames(video_path, frame_dir, interval, start, end, frames)
+    return encode_frames(frame_dir, frames, interval, start)
+
+def extract_windows(video_path, window_sec=None, max_windows=MAX_WINDOWS, frames_per_window=FRAMES_PER_WINDOW):
+
+    # CPU-bound media work for long recordings: one set of encoded frames per window
+    windows = plan_windows(get_video_duration(video_path), window_sec, max_windows)
+    work_dir = tempfile.mkdtemp(prefix="neuroscope_windows_")
+    try:
+        images = [
+            extract_window_frames(video_path, work_dir, index, start, end, frames_per_window)
+            for index, (start, end) in enumerate(windows)
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"windows": windows, "images": images}
+
+def single_request_frames(media, limit=None):
+
+    # One request over a windowed recording takes evenly spaced frames from all its windows
+    if not isinstance(media, dict):
+        return media
+    images = [image for window in media["images"] for image in window]
+    limit = limit or frame_budget()
+    if len(images) <= limit:
+        return images
+    return [images[index * len(images) // limit] for index in range(limit)]
+
+class VisionAgent(BaseClaudeAgent):
+    
+    def analyze(self, video_path, output_path="C:\\Users\\1094828\\SCSP Hackathon\\frames"):
+        
+        raw_images = extract_frames(video_path, output_path)
+        images = get_encoded_frames(output_path)
+
+        return self.analyze_frames(images)
+
+    def analyze_frames(self, images):
+
+        return self.complete(self.build_request(images))
+
+    def build_request(self, images):
+
+        prompt = f"""You are a clinical analysis agent that evaluates given frames sampled from a video of a patient conversating to identify unusual behaviors. 
+        
+                Your task is to identify unusual or abnormal behaviors of the patient that indicate non-ideal human behavior.
+                
+                Also compare the frames with each other to identify change of behaviors and expressions. 
+
+                The patient will always be on the right-hand side of the video.{SHEET_NOTE}
+
+                {OUTPUT_FORMAT}"""
+
         message_content = [{"type": "text", "text": prompt}] + images
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=1024,
-            messages=[{
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
                 "role": "user",
                 "content": message_content
             }]
+        }
+
+    def analyze_windows(self, video_path, window_sec=None, max_windows=MAX_WINDOWS, frames_per_window=FRAMES_PER_WINDOW, concurrency=WINDOW_CONCURRENCY):
+
+        media = extract_windows(video_path, window_sec, max_windows, frames_per_window)
+        return self.analyze_window_frames(media["windows"], media["images"], concurrency)
+
+    def analyze_window_frames(self, windows, window_images, concurrency=WINDOW_CONCURRENCY):
+
+        # Frames were already sampled per window by the media stage, so this only sends requests
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.analyze_frames, images)
+                for images in window_images
+            ]
+            window_results = [future.result() for future in futures]
+
+        if len(windows) == 1:
+            return window_results[0]
+
+        merged = self.complete(self.build_reduce_request(windows, window_results))
+        usage = sum((result.usage for result in window_results), merged.usage)
+        return AgentResult(merged, usage, merged.agent, merged.model)
+
+    def build_reduce_request(self, windows, window_results):
+
+        sections = "\n\n".join(
+            f"Window {index + 1} ({format_time(start)} - {format_time(end)}):\n{summarize_window(result)}"
+            for index, ((start, end), result) in enumerate(zip(windows, window_results))
         )
 
-        return response.content[0].text
+        prompt = f"""You are a clinical analysis agent that merges visual behavior findings from consecutive time windows of one video of a patient conversating.
+
+                Each window was assessed separately from frames sampled within it. Combine them into a single assessment of the whole video.
+
+                A feature is "Unusual" if it is clearly unusual in any window; say in which part of the video it was seen. Use "No Data" only if no window had data for it.
+
+                Under "Change in Behavior", describe how the patient's behavior and expressions change over time across the windows.
+
+                Window Findings:
+
+                {sections}
+
+                {OUTPUT_FORMAT}"""
+
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [{
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}]
+            }]
+        }
@@ -1,16 +1,60 @@
 import streamlit as st
-import tempfile
-from llm.history import HistoryAgent
-from llm.audioanalyze import AudioAgent
-from llm.videoanalyze import VisionAgent
-from llm.diagnosisagent import DiagnosisAgent
-from utils.DSM5MCP import DSM5_ASD_DATA
-from utils.audio_utils import extract_audio, get_timestamped_transcript, transcript_structure
-
-history_agent = HistoryAgent()
-audio_agent = AudioAgent()
-video_agent = VisionAgent()
-diagnosis_agent = DiagnosisAgent()
+import hashlib
+import os
+import uuid
+from datetime import datetime
+from utils.jobqueue import JobQueue, DEFAULT_QUEUE_PATH, DONE, FAILED, publish_depth, start_workers
+from utils.metrics import METRICS_PORT, start_metrics_server
+from utils.upload_utils import store_upload, touch_media, schedule_cleanup
+from utils.case_store import get_case_store
+from utils.tenants import QuotaExceeded, get_tenant_usage
+
+STAGE_LABELS = {
+    "queued": "Waiting for a free worker...",
+    "running": "Starting...",
+    "history": "Analyzing Medical History and Behavior",
+    "frames": "Extracting Video Frames",
+    "vision": "Analyzing Visual Features",
+    "transcription": "Extracting, Transcribing and Structuring Audio...",
+    "audio": "Analyzing Audible Features",
+    "diagnosis": "Generating Final Diagnosis"
+}
+
+@st.cache_resource
+def launch_metrics():
+    # Started before the workers, which report through the shared metrics directory
+    if not METRICS_PORT:
+        return None
+    publish_depth(JobQueue())
+    return start_metrics_server(METRICS_PORT)
+
+@st.cache_resource
+def launch_workers():
+    # Runs once per server process; the workers outlive any single browser session
+    return start_workers(DEFAULT_QUEUE_PATH, int(os.environ.get("NEUROSCOPE_WORKERS", 2)))
+
+@st.cache_resource
+def launch_media_cleanup():
+    return schedule_cleanup(in_use=get_queue().media_in_use)
+
+@st.cache_resource
+def get_queue():
+    return JobQueue()
+
+@st.cache_resource
+def get_store():
+    return get_case_store()
+
+@st.cache_resource
+def get_usage():
+    return get_tenant_usage()
+
+launch_metrics()
+launch_workers()
+launch_media_cleanup()
+queue = get_queue()
+store = get_store()
+usage = get_usage()
 
 st.set_page_config(page_title="NeuroScope AI", layout="centered")
 
@@ -18,6 +62,16 @@ st.markdown("*⚠️DISCLAIMER* This tool should not be currently used as a subs
 
 st.title("NeuroScope AI 🧠: Autism Spectrum Disorder Diagnosis Tool")
 
+# Each clinic can bookmark the app with ?clinic=<name> so its cases share that clinic's quota
+clinic_input = st.text_input("Clinic", value=st.query_params.get("clinic", ""))
+
+patient_input = st.text_input("Patient ID (optional, used to look up past assessments)")
+
+follow_up_input = st.checkbox(
+    "Follow-up visit (update this patient's latest assessment with only the new history and media)",
+    disabled=not patient_input.strip()
+)
+
 age_input = st.number_input(
     "Enter the patient's age", value=None, step=1, placeholder=""
 )
@@ -34,9 +88,14 @@ if video_file is not None:
     
     st.video(video_file)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video:
-        temp_video.write(video_file.read())
-        temp_video_path = temp_video.name
+    # Only copy the upload when a new file arrives, not on every rerun; while the session shows it,
+    # each rerun touches the stored copy so cleanup keeps it, and a copy cleanup already took is stored again
+    if st.session_state.get("upload_file_id") != video_file.file_id or not touch_media(st.session_state["video_path"]):
+        suffix = os.path.splitext(video_file.name)[1] or ".mp4"
+        st.session_state["video_path"], st.session_state["media_hash"] = store_upload(video_file, suffix)
+        st.session_state["upload_file_id"] = video_file.file_id
+
+    temp_video_path = st.session_state["video_path"]
 
 if st.button("Submit For Diagnosis"):
     if age_input is None:
@@ -49,17 +108,54 @@ if st.button("Submit For Diagnosis"):
     if history_input.strip():
         if video_file is not None:
             if age_input is not None:
-                st.success("Submitted For Diagnosis.")
-                with st.spinner("Analyzing Medical History and Behavior", show_time=True):
-                    history_analyze = history_agent.analyze(history_input)
-                with st.spinner("Analyzing Visual Features", show_time=True):
-                    video_analyze = video_agent.analyze(temp_video_path)
-                with st.spinner("Extracting, Transcribing and Structuring Audio...", show_time=True):
-                    audio_path = extract_audio(temp_video_path)
-                    segments = get_timestamped_transcript(audio_path)
-                    transcript = transcript_structure(segments)
-                with st.spinner("Analyzing Audible Features", show_time=True):
-                    audio_analyze = audio_agent.analyze(transcript)
-                with st.spinner("Generating Final Diagnosis", show_time=True):
-                    diagnose = diagnosis_agent.analyze(age_input, history_analyze, video_analyze, audio_analyze, DSM5_ASD_DATA)
-                st.text_area("Diagnosis", diagnose, height=500)
+                # Resubmitting identical inputs in this session reuses the earlier job instead of re-running it
+                inputs_key = hashlib.sha256(f"{st.session_state['media_hash']}|{age_input}|{history_input}|{patient_input}|{follow_up_input}|{clinic_input}".encode("utf-8")).hexdigest()
+                submitted = st.session_state.setdefault("submitted_jobs", {})
+                previous = queue.get(submitted[inputs_key]) if inputs_key in submitted else None
+                try:
+                    if previous is not None and previous["status"] != FAILED:
+                        job_id = previous["id"]
+                    else:
+                        job_id = uuid.uuid4().hex
+                        if usage is not None:
+                            usage.reserve(clinic_input.strip() or None, job_id)
+                        job_id = queue.submit({"age": age_input, "history": history_input, "video_path": temp_video_path, "patient_id": patient_input.strip() or None, "follow_up": follow_up_input, "tenant": clinic_input.strip() or None}, job_id)
+                        submitted[inputs_key] = job_id
+                except QuotaExceeded as error:
+                    st.error(str(error))
+                else:
+                    # Kept in the URL too, so a reloaded or reopened tab finds the same job
+                    st.session_state["job_id"] = job_id
+                    st.query_params["job"] = job_id
+                    st.success("Submitted For Diagnosis.")
+
+@st.fragment(run_every=2)
+def show_job(job_id):
+
+    job = queue.get(job_id)
+    if job is None:
+        st.warning("This diagnosis job could not be found.")
+        return
+
+    if job["status"] == DONE:
+        st.text_area("Diagnosis", job["result"]["diagnosis"], height=500)
+        with st.expander("Token Usage and Cost"):
+            st.json(job["result"]["usage"])
+    elif job["status"] == FAILED:
+        st.error(f"Diagnosis failed: {job['error']}")
+    else:
+        reached = [event["stage"] for event in queue.events(job_id) if event["stage"] in STAGE_LABELS]
+        st.info(STAGE_LABELS.get(job["stage"], job["stage"]))
+        st.caption(" → ".join(STAGE_LABELS[stage] for stage in reached))
+
+current_job = st.session_state.get("job_id") or st.query_params.get("job")
+if current_job:
+    show_job(current_job)
+
+if store is not None and patient_input.strip():
+    past_cases = store.find_cases(patient_id=patient_input.strip(), limit=10, tenant=clinic_input.strip() or None)
+    if past_cases:
+        st.subheader("Past Assessments")
+    for past in past_cases:
+        with st.expander(f"{datetime.fromtimestamp(past['created_at']).strftime('%Y-%m-%d %H:%M')} (age {past['age']})"):
+            st.text(past["diagnosis"])
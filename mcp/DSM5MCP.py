@@ -1,18 +1,24 @@
+from __future__ import annotations
 import asyncio
 import json
 from typing import Any, Dict, List, Optional
-from mcp.server import Server
-from mcp.server.models import InitializationOptions
-from mcp.server.stdio import stdio_server
-from mcp.types import (
-    Resource,
-    Tool,
-    TextContent,
-    ImageContent,
-    EmbeddedResource,
-    LoggingLevel
-)
-import mcp.types as types
+from utils.tracing import span
+
+def load_mcp():
+    # The MCP SDK is only needed once a server is built, so importing DSM5_ASD_DATA alone stays cheap
+    global Server, InitializationOptions, stdio_server, Resource, Tool, TextContent, ImageContent, EmbeddedResource, LoggingLevel, types
+    from mcp.server import Server
+    from mcp.server.models import InitializationOptions
+    from mcp.server.stdio import stdio_server
+    from mcp.types import (
+        Resource,
+        Tool,
+        TextContent,
+        ImageContent,
+        EmbeddedResource,
+        LoggingLevel
+    )
+    import mcp.types as types
 
 DSM5_ASD_DATA = {
     
@@ -380,6 +386,7 @@ DSM5_ASD_DATA = {
 
 class DSM5MCPServer:
     def __init__(self):
+        load_mcp()
         self.server = Server("dsm5-asd-server")
         self.setup_handlers()
     
@@ -1070,3 +1077,13 @@ class DSM5MCPServer:
 
         formatted = "\n\n".join(f"### {title} ###\n{section}" for title, section in raw_results)
         return formatted
+
+    async def dispatch(self, name: str, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """Run a tool call through the registered MCP request handler"""
+        request = types.CallToolRequest(
+            method="tools/call",
+            params=types.CallToolRequestParams(name=name, arguments=arguments)
+        )
+        with span(f"mcp.{name}"):
+            result = await self.server.request_handlers[types.CallToolRequest](request)
+        return result.root.content
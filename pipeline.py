@@ -0,0 +1,228 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from llm.history import HistoryAgent, history_delta
+from llm.audioanalyze import AudioAgent
+from llm.videoanalyze import VisionAgent, WINDOW_SEC, extract_windows
+from llm.diagnosisagent import DiagnosisAgent
+from utils.image_utils import extract_frames, encode_frames, frame_budget, get_video_duration, TILE_LAYOUT
+from utils.frame_hash import get_distinct_frames, get_frame_index, DEDUPE_METHOD, DEDUPE_THRESHOLD, DEDUPE_OVERSAMPLE
+from utils.audio_utils import extract_audio, load_audio, get_timestamped_transcript, transcript_structure, load_whisper_profile, TRIM_SILENCE, WHISPER_SAMPLE_RATE
+from utils.speaker_turns import label_speakers
+from utils.DSM5MCP import DSM5_ASD_DATA
+from utils.tracing import case
+from utils.case_store import get_case_store, input_key
+from utils.tenants import tenant
+from utils.metrics import cache_lookup
+from llm.usage import LEDGER
+from llm.scheduler import BATCH, INTERACTIVE, priority
+from llm.findings import Finding, parse_findings, format_findings, update_findings, diff_findings, format_changes
+
+class Agents:
+
+    __slots__ = ("history", "audio", "vision", "diagnosis")
+
+    def __init__(self, **kwargs):
+
+        self.history = HistoryAgent(**kwargs)
+        self.audio = AudioAgent(**kwargs)
+        self.vision = VisionAgent(**kwargs)
+        self.diagnosis = DiagnosisAgent(**kwargs)
+
+MEDIA_CACHE_SIZE = int(os.environ.get("NEUROSCOPE_MEDIA_CACHE_SIZE", 8))
+
+_media_cache = OrderedDict()
+_media_cache_lock = threading.Lock()
+
+def media_key(video_path):
+
+    # Uploads are stored under their content hash; anything else is keyed by path, size and mtime
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    if re.fullmatch(r"[0-9a-f]{64}", name):
+        return name
+    stat = os.stat(video_path)
+    return os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns
+
+def cached_media_stage(func):
+
+    @functools.wraps(func)
+    def wrapper(video_path, *args):
+
+        key = (func.__name__, media_key(video_path), args)
+        with _media_cache_lock:
+            cache_lookup("media", key in _media_cache)
+            if key in _media_cache:
+                _media_cache.move_to_end(key)
+                return _media_cache[key]
+
+        result = func(video_path, *args)
+
+        with _media_cache_lock:
+            _media_cache[key] = result
+            while len(_media_cache) > MEDIA_CACHE_SIZE:
+                _media_cache.popitem(last=False)
+        return result
+
+    return wrapper
+
+@cached_media_stage
+def extract_visual_media(video_path):
+
+    # Long recordings are sampled per window here, so the vision stage only sends frames and never decodes
+    if WINDOW_SEC > 0 and get_video_duration(video_path) > WINDOW_SEC:
+        return extract_windows(video_path)
+
+    if DEDUPE_METHOD:
+        frames = frame_budget()
+        key = json.dumps([str(media_key(video_path)), frames, TILE_LAYOUT, DEDUPE_METHOD, DEDUPE_THRESHOLD, DEDUPE_OVERSAMPLE])
+        return get_distinct_frames(video_path, frames, index=get_frame_index(), key=key, media=str(media_key(video_path)))
+
+    frame_dir = tempfile.mkdtemp(prefix="neuroscope_frames_")
+    try:
+        frames = frame_budget()
+        extract_frames(video_path, frame_dir, max_frames=frames)
+        return encode_frames(frame_dir, frames)
+    finally:
+        shutil.rmtree(frame_dir, ignore_errors=True)
+
+@cached_media_stage
+def extract_audible_media(video_path, whisper_model=None):
+
+    audio_path = extract_audio(video_path)
+    try:
+        # Decoded once: silence trimming, transcription and speaker labelling share the samples
+        audio = load_audio(audio_path)
+        segments = label_speakers(get_timestamped_transcript(audio_path, whisper_model, samples=audio), audio, WHISPER_SAMPLE_RATE)
+    finally:
+        os.remove(audio_path)
+
+    return segments, transcript_structure(segments)
+
+def process_media(video_path, whisper_model=None):
+
+    # CPU-bound and self-contained so it can run in a worker process
+    images = extract_visual_media(video_path)
+    segments, transcript = extract_audible_media(video_path, whisper_model)
+
+    return {"images": images, "segments": segments, "transcript": transcript}
+
+def analyze_video(agents, video_path, images):
+
+    # Long recordings get the windowed map-reduce pass over the frames extract_visual_media sampled per window;
+    # short ones keep the single call
+    if isinstance(images, dict):
+        return agents.vision.analyze_window_frames(images["windows"], images["images"])
+    return agents.vision.analyze_frames(images)
+
+def diagnose(agents, age, history_analysis, video_analysis, audio_analysis):
+
+    return agents.diagnosis.analyze(age, history_analysis, video_analysis, audio_analysis, DSM5_ASD_DATA)
+
+@functools.lru_cache(maxsize=None)
+def prompt_version(agent_class):
+
+    # Prompts live in the agent's module, so any edit to it stops stored outputs from being reused
+    with open(inspect.getsourcefile(agent_class), "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+def run_case(agents, payload, progress=None, whisper_model=None):
+
+    # payload: age, history, video_path and optionally patient_id and tenant; progress is called with each stage name as it starts
+    progress = progress or (lambda stage: None)
+    store = get_case_store()
+    media = str(media_key(payload["video_path"]))
+    timings = {}
+
+    def stage(name, key_parts, func):
+
+        # Outputs are stored by their inputs, so the same media or history submitted again skips the work
+        key = input_key(*key_parts)
+        output = store.stage_output(name, key) if store is not None else None
+        if store is not None:
+            cache_lookup("stage_output", output is not None)
+        if output is not None:
+            timings[name] = 0.0
+            return output
+
+        start = time.perf_counter()
+        output = func()
+        timings[name] = round(time.perf_counter() - start, 3)
+        if store is not None:
+            store.put_stage_output(name, key, output)
+        return output
+
+    def analyze_frames():
+        progress("frames")
+        images = extract_visual_media(payload["video_path"])
+        progress("vision")
+        return analyze_video(agents, payload["video_path"], images)
+
+    vision_config = (agents.vision.model, prompt_version(type(agents.vision)), WINDOW_SEC, TILE_LAYOUT, DEDUPE_METHOD, DEDUPE_THRESHOLD, frame_budget())
+    whisper_config = (whisper_model, load_whisper_profile(), TRIM_SILENCE)
+
+    # Follow-up visits start from the patient's latest stored case and only analyze what is new
+    previous = None
+    if payload.get("follow_up") and store is not None and payload.get("patient_id"):
+        previous = store.latest_case(payload["patient_id"], payload.get("tenant"))
+
+    def analyze_history(history):
+        return stage("history", (history, agents.history.model, prompt_version(type(agents.history))), lambda: agents.history.analyze(history))
+
+    level = BATCH if payload.get("priority") == "batch" else INTERACTIVE
+    with case(payload.get("case_id")) as case_id, priority(level), tenant(payload.get("tenant")):
+        progress("history")
+        if previous is None:
+            history_analysis = analyze_history(payload["history"])
+        else:
+            prior_findings = [Finding.from_dict(finding) for finding in previous["findings"]]
+            delta = history_delta(previous["history"], payload["history"])
+            delta_findings = parse_findings(analyze_history(delta), "history") if delta else []
+            history_analysis = format_findings(update_findings([finding for finding in prior_findings if finding.modality == "history"], delta_findings))
+            payload = {**payload, "history": "\n\n".join(part for part in (previous["history"], delta) if part)}
+        video_analysis = stage("vision", (media, vision_config), analyze_frames)
+        progress("transcription")
+        segments, transcript = stage("transcription", (media, whisper_config), lambda: extract_audible_media(payload["video_path"], whisper_model))
+        progress("audio")
+        audio_analysis = stage("audio", (transcript, agents.audio.model, prompt_version(type(agents.audio))), lambda: agents.audio.analyze(transcript))
+        progress("diagnosis")
+        start = time.perf_counter()
+        changes = None
+        if previous is None:
+            diagnosis = diagnose(agents, payload["age"], history_analysis, video_analysis, audio_analysis)
+        else:
+            current_findings = [
+                finding
+                for modality, analysis in (("history", history_analysis), ("vision", video_analysis), ("audio", audio_analysis))
+                for finding in parse_findings(analysis, modality)
+            ]
+            changes = diff_findings(prior_findings, current_findings)
+            # Nothing changed and the age is the same, so the previous conclusion still stands
+            if not changes and payload["age"] == previous["age"]:
+                diagnosis = previous["diagnosis"]
+            else:
+                diagnosis = agents.diagnosis.update(payload["age"], previous["diagnosis"], format_changes(changes), DSM5_ASD_DATA)
+        timings["diagnosis"] = round(time.perf_counter() - start, 3)
+
+    result = {
+        "case_id": case_id,
+        "history_analysis": history_analysis,
+        "video_analysis": video_analysis,
+        "audio_analysis": audio_analysis,
+        "diagnosis": diagnosis,
+        "usage": LEDGER.pop(case_id),
+        "timings": timings
+    }
+    if previous is not None:
+        result["previous_case_id"] = previous["id"]
+        result["changes"] = format_changes(changes)
+    if store is not None:
+        store.save_case(result, payload, media)
+    return result
@@ -0,0 +1,425 @@
+import argparse
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from aiohttp import web
+from pipeline import Agents, extract_visual_media, extract_audible_media, analyze_video, diagnose
+from llm.usage import LEDGER
+from llm.scheduler import BATCH, INTERACTIVE, priority
+from utils.image_utils import get_video_duration
+from utils.metrics import CONTENT_TYPE, add_collector, clear_stale, enable_snapshots, inc, observe, render, set_gauge
+from utils.tenants import DEFAULT_TENANT, QuotaExceeded, get_tenant_usage, start_of_day, tenant, tenant_quota
+from utils.tracing import case
+from utils.upload_utils import schedule_cleanup
+
+UPLOAD_DIR = os.environ.get("NEUROSCOPE_UPLOAD_DIR", "uploads")
+CHUNK_SIZE = 1 << 20
+# JSON bodies such as POST /cases; uploads are streamed and checked against --max-upload instead
+MAX_BODY_BYTES = 16 << 20
+
+class Overloaded(Exception):
+    pass
+
+class StageGate:
+
+    def __init__(self, name, concurrency, max_waiting):
+
+        self.name = name
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.queue = []
+        self.sequence = itertools.count()
+        self.waiting = 0
+        self.active = 0
+        self.tenants = {}
+        self.virtual = {}
+        self.virtual_now = 0.0
+
+    def full(self):
+        return self.waiting >= self.max_waiting
+
+    async def run(self, func, name=DEFAULT_TENANT, cost=1.0):
+
+        # Weighted fair queueing across tenants: each call is stamped with its tenant's virtual finish time,
+        # so a clinic with a deep backlog of long videos waits behind its own work rather than everyone else's
+        start = max(self.virtual_now, self.virtual.get(name, 0.0))
+        self.virtual[name] = start + max(cost, 1e-3) / tenant_quota(name)["weight"]
+
+        if self.active < self.concurrency and not self.waiting:
+            self.active += 1
+        else:
+            granted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.queue, (start, next(self.sequence), granted))
+            self.waiting += 1
+            try:
+                await granted
+            except asyncio.CancelledError:
+                # Cancelled just as a slot was handed over, so pass it on
+                if granted.done() and not granted.cancelled():
+                    self.active -= 1
+                    self.wake()
+                raise
+            finally:
+                self.waiting -= 1
+
+        self.virtual_now = max(self.virtual_now, start)
+        self.tenants[name] = self.tenants.get(name, 0) + 1
+        try:
+            return await func()
+        finally:
+            self.tenants[name] -= 1
+            self.active -= 1
+            self.wake()
+
+    def wake(self):
+
+        # A freed slot goes to the waiter with the smallest virtual time; cancelled waiters are skipped
+        while self.queue and self.active < self.concurrency:
+            _, _, granted = heapq.heappop(self.queue)
+            if not granted.done():
+                self.active += 1
+                granted.set_result(None)
+
+    def snapshot(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "tenants": {name: count for name, count in self.tenants.items() if count}
+        }
+
+class CaseRun:
+
+    def __init__(self, case_id, payload):
+
+        self.case_id = case_id
+        self.payload = payload
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.events = [{"stage": "queued", "at": time.time()}]
+        self.changed = asyncio.Event()
+
+    def emit(self, stage):
+
+        self.events.append({"stage": stage, "at": time.time()})
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self):
+        return {"case_id": self.case_id, "status": self.status, "result": self.result, "error": self.error, "events": self.events}
+
+class DiagnosisService:
+
+    def __init__(self, agents, media_pool, gates, max_pending, result_ttl=3600, max_finished=1000):
+
+        self.agents = agents
+        self.media_pool = media_pool
+        self.gates = gates
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.cases = {}
+        # Finished case IDs in the order they finished, for eviction
+        self.finished = {}
+        self.pending = 0
+        self.tenant_pending = {}
+        self.usage = get_tenant_usage()
+
+    def retire(self, run):
+
+        self.finished[run.case_id] = time.monotonic()
+        self.evict()
+
+    def evict(self):
+
+        # Results stay readable for result_ttl seconds, and only the newest max_finished are kept
+        now = time.monotonic()
+        while self.finished:
+            case_id = next(iter(self.finished))
+            if now - self.finished[case_id] < self.result_ttl and len(self.finished) <= self.max_finished:
+                break
+            del self.finished[case_id]
+            self.cases.pop(case_id, None)
+
+    async def in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.media_pool, func, *args)
+
+    def admit(self, name):
+
+        if self.pending >= self.max_pending:
+            raise Overloaded("Too many cases in progress")
+        for gate in self.gates.values():
+            if gate.full():
+                raise Overloaded(f"The {gate.name} stage queue is full")
+
+        max_concurrent = tenant_quota(name)["max_concurrent"]
+        if max_concurrent and self.tenant_pending.get(name, 0) >= max_concurrent:
+            raise Overloaded(f"Tenant {name} already has {int(max_concurrent)} cases in progress")
+
+    async def submit(self, payload):
+
+        name = payload.get("tenant") or DEFAULT_TENANT
+        # Always generated here, so a client can't reuse an ID and mix its outputs into another case
+        case_id = uuid.uuid4().hex
+
+        # Slots are taken before the token reservation is awaited, so concurrent submissions can't both pass the checks
+        self.admit(name)
+        self.pending += 1
+        self.tenant_pending[name] = self.tenant_pending.get(name, 0) + 1
+        if self.usage is not None:
+            try:
+                await asyncio.to_thread(self.usage.reserve, name, case_id)
+            except QuotaExceeded as error:
+                self.pending -= 1
+                self.tenant_pending[name] -= 1
+                raise Overloaded(str(error))
+
+        self.evict()
+        run = CaseRun(case_id, {**payload, "tenant": name})
+        self.cases[run.case_id] = run
+        asyncio.create_task(self.execute(run))
+        return run
+
+    async def execute(self, run):
+
+        gates = self.gates
+        payload = run.payload
+        name = payload["tenant"]
+        started_at = time.time()
+        history_task = vision_task = None
+
+        async def stage(stage_name, gate, func, cost=1.0):
+            run.emit(stage_name)
+            return await gates[gate].run(func, name, cost)
+
+        try:
+            run.status = "running"
+            level = BATCH if payload.get("priority") == "batch" else INTERACTIVE
+            # Media stages are charged by recording length, so fair shares are shares of CPU time rather than of calls
+            duration = await asyncio.to_thread(get_video_duration, payload["video_path"])
+            with case(run.case_id), priority(level), tenant(name):
+                history_task = asyncio.create_task(stage("history", "llm", lambda: asyncio.to_thread(self.agents.history.analyze, payload["history"])))
+                images = await stage("frames", "media", lambda: self.in_pool(extract_visual_media, payload["video_path"]), duration)
+                vision_task = asyncio.create_task(stage("vision", "vision", lambda: asyncio.to_thread(analyze_video, self.agents, payload["video_path"], images)))
+                segments, transcript = await stage("transcription", "whisper", lambda: self.in_pool(extract_audible_media, payload["video_path"]), duration)
+                audio_analysis = await stage("audio", "llm", lambda: asyncio.to_thread(self.agents.audio.analyze, transcript))
+                history_analysis, video_analysis = await asyncio.gather(history_task, vision_task)
+                diagnosis = await stage("diagnosis", "diagnosis", lambda: asyncio.to_thread(
+                    diagnose, self.agents, payload["age"], history_analysis, video_analysis, audio_analysis
+                ))
+
+            run.result = {
+                "history_analysis": history_analysis,
+                "video_analysis": video_analysis,
+                "audio_analysis": audio_analysis,
+                "diagnosis": diagnosis,
+                "usage": LEDGER.pop(run.case_id)
+            }
+            run.status = "done"
+        except Exception as error:
+            run.status = "failed"
+            run.error = f"{type(error).__name__}: {error}"
+        finally:
+            # A failed stage leaves the concurrent ones running; stop them so their gate slots are given back
+            tasks = [task for task in (history_task, vision_task) if task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.pending -= 1
+            self.tenant_pending[name] -= 1
+            inc("neuroscope_cases_total", status=run.status)
+            observe("neuroscope_case_duration_seconds", time.time() - run.events[0]["at"])
+            if self.usage is not None:
+                usage = run.result["usage"] if run.result else LEDGER.pop(run.case_id)
+                await asyncio.to_thread(self.usage.record_case, name, run.case_id, run.status, run.events[0]["at"], started_at, usage)
+            run.emit(run.status)
+            self.retire(run)
+
+def overloaded_response(error):
+    return web.json_response({"error": str(error)}, status=429, headers={"Retry-After": "5"})
+
+async def upload_media(request):
+
+    max_upload = request.app["max_upload"]
+    if request.content_length is not None and request.content_length > max_upload:
+        raise web.HTTPRequestEntityTooLarge(max_upload, request.content_length)
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    temp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+
+    # Stream the body to disk in fixed-size chunks so large recordings never sit in memory;
+    # chunked bodies have no length up front, so the limit is checked as they arrive
+    try:
+        with open(temp_path, "wb") as file:
+            async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_upload:
+                    raise web.HTTPRequestEntityTooLarge(max_upload, size)
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    upload_id = digest.hexdigest()
+    final_path = os.path.join(UPLOAD_DIR, upload_id)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+        os.utime(final_path)
+    else:
+        os.replace(temp_path, final_path)
+
+    return web.json_response({"upload_id": upload_id, "bytes": size}, status=201)
+
+async def submit_case(request):
+
+    service = request.app["service"]
+    body = await request.json()
+
+    missing = [field for field in ("age", "history", "upload_id") if body.get(field) in (None, "")]
+    if missing:
+        return web.json_response({"error": f"Missing fields: {', '.join(missing)}"}, status=400)
+
+    video_path = os.path.join(UPLOAD_DIR, os.path.basename(body["upload_id"]))
+    if not os.path.exists(video_path):
+        return web.json_response({"error": "Unknown upload_id"}, status=404)
+
+    try:
+        run = await service.submit({
+            "age": body["age"], "history": body["history"], "video_path": video_path, "priority": body.get("priority"),
+            "tenant": body.get("tenant")
+        })
+    except Overloaded as error:
+        return overloaded_response(error)
+
+    return web.json_response({"case_id": run.case_id, "status": run.status}, status=202)
+
+def find_case(request):
+
+    run = request.app["service"].cases.get(request.match_info["case_id"])
+    if run is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown case"}), content_type="application/json")
+    return run
+
+async def get_case(request):
+    return web.json_response(find_case(request).to_dict())
+
+async def case_events(request):
+
+    run = find_case(request)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    sent = 0
+    while True:
+        changed = run.changed
+        for event in run.events[sent:]:
+            await response.write(f"event: stage\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+        sent = len(run.events)
+        if run.status in ("done", "failed"):
+            break
+        await changed.wait()
+
+    await response.write_eof()
+    return response
+
+async def get_status(request):
+
+    service = request.app["service"]
+    return web.json_response({
+        "pending": service.pending,
+        "max_pending": service.max_pending,
+        "stages": {name: gate.snapshot() for name, gate in service.gates.items()}
+    })
+
+def publish_service(service):
+
+    def collector():
+        set_gauge("neuroscope_cases_in_progress", service.pending)
+        for name, gate in service.gates.items():
+            set_gauge("neuroscope_stage_active", gate.active, stage=name)
+            set_gauge("neuroscope_stage_waiting", gate.waiting, stage=name)
+
+    add_collector(collector)
+
+async def get_metrics(request):
+    # Rendering reads the other processes' snapshot files, so it stays off the event loop
+    return web.Response(body=(await asyncio.to_thread(render)).encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+async def get_tenants(request):
+
+    # Cases in flight right now, plus today's finished cases, tokens, cost and latency percentiles per tenant
+    service = request.app["service"]
+    today = await asyncio.to_thread(service.usage.summary, start_of_day()) if service.usage is not None else {}
+    names = set(today) | {name for name, count in service.tenant_pending.items() if count}
+    return web.json_response({
+        name: {"pending": service.tenant_pending.get(name, 0), "quota": tenant_quota(name), "today": today.get(name)}
+        for name in sorted(names)
+    })
+
+def make_app(args):
+
+    # Media workers report through snapshot files that /metrics merges
+    enable_snapshots()
+    media_pool = ProcessPoolExecutor(max_workers=args.media_workers)
+    # At most one hedge per running LLM call; read when the agents below create the scheduler
+    os.environ.setdefault("NEUROSCOPE_LLM_HEDGE_WORKERS", str(args.llm_slots + args.vision_slots + args.diagnosis_slots))
+    gates = {
+        "media": StageGate("media", args.media_workers, args.max_waiting),
+        "whisper": StageGate("whisper", args.whisper_slots, args.max_waiting),
+        "llm": StageGate("llm", args.llm_slots, args.max_waiting),
+        "vision": StageGate("vision", args.vision_slots, args.max_waiting),
+        "diagnosis": StageGate("diagnosis", args.diagnosis_slots, args.max_waiting),
+    }
+
+    app = web.Application(client_max_size=MAX_BODY_BYTES)
+    app["max_upload"] = args.max_upload
+    app["service"] = DiagnosisService(Agents(), media_pool, gates, args.max_pending, args.result_ttl, args.max_finished)
+    publish_service(app["service"])
+    clear_stale()
+    app.router.add_post("/uploads", upload_media)
+    app.router.add_post("/cases", submit_case)
+    app.router.add_get("/cases/{case_id}", get_case)
+    app.router.add_get("/cases/{case_id}/events", case_events)
+    app.router.add_get("/status", get_status)
+    app.router.add_get("/tenants", get_tenants)
+    app.router.add_get("/metrics", get_metrics)
+
+    async def shutdown(app):
+        media_pool.shutdown(wait=False, cancel_futures=True)
+
+    app.on_cleanup.append(shutdown)
+    schedule_cleanup(UPLOAD_DIR)
+    return app
+
+def main():
+
+    cpus = os.cpu_count() or 2
+    parser = argparse.ArgumentParser(description="Async HTTP API for the NeuroScope diagnosis pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--media-workers", type=int, default=max(1, cpus // 2))
+    parser.add_argument("--whisper-slots", type=int, default=max(1, cpus // 4))
+    parser.add_argument("--llm-slots", type=int, default=8)
+    parser.add_argument("--vision-slots", type=int, default=4)
+    parser.add_argument("--diagnosis-slots", type=int, default=4)
+    parser.add_argument("--max-waiting", type=int, default=32, help="Queued calls per stage before new cases get a 429")
+    parser.add_argument("--max-pending", type=int, default=64, help="Cases in progress before new cases get a 429")
+    parser.add_argument("--result-ttl", type=float, default=3600, help="Seconds a finished case stays readable")
+    parser.add_argument("--max-finished", type=int, default=1000, help="Finished cases kept in memory")
+    parser.add_argument("--max-upload", type=int, default=4 << 30, help="Largest accepted upload in bytes")
+    args = parser.parse_args()
+
+    web.run_app(make_app(args), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from llm.diagnosisagent import summarize_analysis
+from llm.findings import NO_DATA, NORMAL, UNUSUAL, Finding, compact_findings, diff_findings, parse_findings, update_findings
+
+ANALYSIS = """Eye Contact: [Unusual, avoids gaze when
+called by name]
+- **Pointing**: [Normal]
+Echolalia : No Data
+Additional Mentions:
+...[Unusual, lines up toys by colour]
+"""
+
+def test_parse_findings():
+
+    findings = parse_findings(ANALYSIS, "vision")
+    assert findings == [
+        Finding("Eye Contact", "vision", UNUSUAL, "avoids gaze when called by name"),
+        Finding("Pointing", "vision", NORMAL),
+        Finding("Echolalia", "vision", NO_DATA),
+        Finding("Additional Mention", "vision", UNUSUAL, "lines up toys by colour")
+    ]
+
+def test_parse_findings_normalizes_status_case():
+
+    assert parse_findings("Joint Attention: [unusual - rarely follows a point]", "history") == [
+        Finding("Joint Attention", "history", UNUSUAL, "rarely follows a point")
+    ]
+
+def test_parse_findings_ignores_free_text():
+    assert parse_findings("The child seems well.\nNothing else to report.", "audio") == []
+
+def test_compact_findings():
+
+    findings = parse_findings(ANALYSIS, "vision")
+    assert compact_findings(findings) == "- Eye Contact: avoids gaze when called by name\n- Additional Mention: lines up toys by colour"
+    assert compact_findings([Finding("Pointing", "vision", NORMAL)]) == "No unusual findings."
+
+def test_summarize_analysis_falls_back_to_raw_text():
+
+    assert summarize_analysis("Free-form notes without findings.", "audio") == "Free-form notes without findings."
+    assert summarize_analysis(ANALYSIS, "vision").startswith("- Eye Contact:")
+
+def test_update_findings():
+
+    previous = [
+        Finding("Eye Contact", "history", UNUSUAL, "avoids gaze"),
+        Finding("Pointing", "history", NORMAL),
+        Finding("Additional Mention", "history", UNUSUAL, "toe walking")
+    ]
+    updates = [
+        Finding("eye contact", "history", NORMAL),
+        Finding("Pointing", "history", NO_DATA),
+        Finding("Echolalia", "history", UNUSUAL, "repeats phrases"),
+        Finding("Additional Mention", "history", UNUSUAL, "toe walking"),
+        Finding("Additional Mention", "history", UNUSUAL, "hand flapping")
+    ]
+
+    merged = update_findings(previous, updates)
+    assert merged == [
+        Finding("eye contact", "history", NORMAL),
+        Finding("Pointing", "history", NORMAL),
+        Finding("Echolalia", "history", UNUSUAL, "repeats phrases"),
+        Finding("Additional Mention", "history", UNUSUAL, "toe walking"),
+        Finding("Additional Mention", "history", UNUSUAL, "hand flapping")
+    ]
+
+def test_diff_findings():
+
+    previous = [Finding("Eye Contact", "vision", UNUSUAL, "avoids gaze"), Finding("Pointing", "vision", NORMAL)]
+    current = [
+        Finding("Eye Contact", "vision", UNUSUAL, "avoids gaze"),
+        Finding("Pointing", "vision", UNUSUAL, "does not point"),
+        Finding("Echolalia", "audio", NORMAL),
+        Finding("Additional Mention", "vision", UNUSUAL, "toe walking")
+    ]
+
+    assert diff_findings(previous, current) == [(current[1], NORMAL), (current[2], NO_DATA)]
+
+def test_diff_findings_ignores_reworded_explanations():
+
+    previous = [Finding("Eye Contact", "vision", UNUSUAL, "avoids gaze")]
+    assert diff_findings(previous, [Finding("Eye Contact", "vision", UNUSUAL, "looks away when called")]) == []
@@ -0,0 +1,47 @@
+import numpy as np
+from utils.frame_hash import FrameIndex, dhash, hamming, select_distinct
+
+def frames(*levels):
+
+    # Each frame is a horizontal gradient or its mirror, which dhash tells apart completely
+    ramp = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (48, 1))
+    return [np.dstack([ramp if level else ramp[:, ::-1]] * 3) for level in levels]
+
+def test_identical_frames_hash_alike():
+
+    hashes = dhash(frames(1, 1, 0))
+    distances = hamming(hashes, hashes)
+    assert distances[0, 1] == 0
+    assert distances[0, 2] > 32
+
+def test_select_distinct_keeps_regular_slots_when_frames_differ():
+
+    hashes = np.array([0xFF << (8 * index) for index in range(6)], dtype=np.uint64)
+    assert select_distinct(hashes, 2, 3) == [0, 2, 4]
+
+def test_select_distinct_replaces_repeated_slots():
+
+    # Slots 0, 2 and 4 all show the same scene; frame 3 is the only other one
+    hashes = np.array([0, 0, 0, 2**64 - 1, 0, 0], dtype=np.uint64)
+    assert select_distinct(hashes, 2, 3) == [0, 3]
+
+def test_select_distinct_stops_at_the_slot_count():
+
+    hashes = np.array([0, 0xFF, 0xFF00, 0xFF0000], dtype=np.uint64)
+    assert select_distinct(hashes, 2, 3) == [0, 2]
+
+def test_frame_index_prunes_unused_entries(tmp_path):
+
+    index = FrameIndex(str(tmp_path / "frames.db"), max_age=60)
+    index.put_blocks(["old", "kept"], [{"n": 1}, {"n": 2}])
+    index.put_selection("old", ["old"])
+    index.put_selection("kept", ["kept"])
+    with index.connect() as connection:
+        connection.execute("UPDATE blocks SET used_at = used_at - 120")
+        connection.execute("UPDATE selections SET used_at = used_at - 120")
+
+    # Reading a selection counts as use
+    assert index.selection("kept") == [{"n": 2}]
+    assert index.prune() == 2
+    assert index.selection("old") is None
+    assert index.selection("kept") == [{"n": 2}]
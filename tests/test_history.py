@@ -0,0 +1,28 @@
+from llm.history import pack, split_history
+
+def test_pack():
+
+    assert pack(["aa", "bb", "cc"], 5, "\n") == ["aa\nbb", "cc"]
+    assert pack(["toolong", "x"], 3, "\n") == ["toolong", "x"]
+    assert pack([], 10, "\n") == []
+
+def test_split_history_keeps_short_history_whole():
+    assert split_history("  Note one.\n\nNote two.  ", 100) == ["Note one.\n\nNote two."]
+
+def test_split_history_prefers_document_breaks():
+
+    history = "First visit.\n---\nSecond visit.\fThird visit."
+    assert split_history(history, 20) == ["First visit.", "Second visit.", "Third visit."]
+    assert split_history(history, 40) == ["First visit.\n\nSecond visit.", "Third visit."]
+
+def test_split_history_splits_long_documents():
+
+    paragraphs = [f"Paragraph {index} " + "x" * 30 for index in range(4)]
+    chunks = split_history("\n\n".join(paragraphs), 90)
+    assert chunks == ["\n\n".join(paragraphs[:2]), "\n\n".join(paragraphs[2:])]
+
+def test_split_history_cuts_overlong_lines():
+
+    chunks = split_history("y" * 25, 10)
+    assert chunks == ["y" * 10, "y" * 10, "y" * 5]
+    assert all(len(chunk) <= 10 for chunk in split_history(("z" * 15 + "\n") * 3, 10))
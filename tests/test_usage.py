@@ -0,0 +1,49 @@
+import base64
+import io
+import pytest
+from PIL import Image
+from llm.usage import CaseLedger, TokenBudget, TokenBudgetExceeded, Usage, estimate_request_tokens
+from utils.tracing import case
+
+def image_block(width, height):
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="JPEG")
+    return {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": base64.b64encode(buffer.getvalue()).decode("utf-8")}}
+
+def request(content, max_tokens=100):
+    return {"max_tokens": max_tokens, "messages": [{"role": "user", "content": content}]}
+
+def test_budget_without_limits_passes_requests_through():
+
+    params = request("x" * 4000)
+    assert TokenBudget().enforce(params) is params
+
+def test_budget_rejects_text_over_the_request_limit():
+
+    budget = TokenBudget(max_request_tokens=500)
+    assert budget.enforce(request("x" * 1000)) is not None
+    with pytest.raises(TokenBudgetExceeded):
+        budget.enforce(request("x" * 4000))
+
+def test_budget_downscales_images_to_fit():
+
+    params = request([{"type": "text", "text": "Describe the frames."}, image_block(1024, 768), image_block(1024, 768)])
+    text_tokens, picture_tokens = estimate_request_tokens(params)
+    limit = text_tokens + 100 + picture_tokens // 2
+
+    fitted = TokenBudget(max_request_tokens=limit).enforce(params)
+    assert fitted is not params
+    assert sum(estimate_request_tokens(fitted)) + 100 <= limit
+    assert fitted["messages"][0]["content"][0] == params["messages"][0]["content"][0]
+
+def test_budget_counts_tokens_already_used_by_the_case():
+
+    ledger = CaseLedger()
+    budget = TokenBudget(max_case_tokens=1000, ledger=ledger)
+    with case("case-1") as case_id:
+        assert budget.limit() == 1000
+        ledger.record(case_id, "HistoryAgent", None, Usage(700, 200), 0.0)
+        assert budget.limit() == 100
+        with pytest.raises(TokenBudgetExceeded):
+            budget.enforce(request("x" * 400))
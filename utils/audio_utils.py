@@ -1,38 +1,201 @@
-from faster_whisper import WhisperModel
-from moviepy import VideoFileClip
 import tempfile
+import os
+import bisect
+import functools
+import json
+import wave
+from utils.tracing import traced, current_span
+from utils.metrics import add_sampler, in_flight, set_gauge
 
+WHISPER_SAMPLE_RATE = 16000
+TRIM_SILENCE = os.environ.get("NEUROSCOPE_TRIM_SILENCE", "1") != "0"
+MIN_SILENCE_SEC = float(os.environ.get("NEUROSCOPE_MIN_SILENCE_SEC", 2.0))
+SILENCE_DB = float(os.environ.get("NEUROSCOPE_SILENCE_DB", 35))
+WHISPER_PROFILE_PATH = os.environ.get("NEUROSCOPE_WHISPER_PROFILE", "whisper_profile.json")
+
+DEFAULT_WHISPER_PROFILE = {
+    "model_size": "base",
+    "device": "cpu",
+    "compute_type": "int8",
+    "cpu_threads": 0,
+    "num_workers": 1,
+    "beam_size": 5,
+    "vad_parameters": {"threshold": 0.5}
+}
+
+@traced("extract_audio")
 def extract_audio(video_path):
 
+    from moviepy import VideoFileClip
+
     output_path = tempfile.mktemp(suffix=".wav")
     clip = VideoFileClip(video_path)
     clip.audio.write_audiofile(output_path, codec='pcm_s16le')
+    current_span().set(bytes_in=os.path.getsize(video_path), bytes_out=os.path.getsize(output_path))
     return output_path
 
-def get_timestamped_transcript(audio_path, model_size="base"):
+@functools.lru_cache(maxsize=1)
+def load_whisper_profile(path=WHISPER_PROFILE_PATH):
+
+    # Written by benchmarks.whisper_tune; missing keys fall back to the defaults
+    profile = dict(DEFAULT_WHISPER_PROFILE)
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            profile.update(json.load(file).get("profile", {}))
+    return profile
+
+@functools.lru_cache(maxsize=4)
+def get_whisper_model(model_size="base", device="cpu", compute_type="int8", cpu_threads=0, num_workers=1):
+    # Loading weights dominates short transcriptions, so each process keeps its models
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads, num_workers=num_workers)
+
+add_sampler(lambda: set_gauge("neuroscope_whisper_models_loaded", get_whisper_model.cache_info().currsize))
+
+def read_wav(audio_path):
+
+    import numpy as np
+
+    with wave.open(audio_path, "rb") as file:
+        channels = file.getnchannels()
+        sample_rate = file.getframerate()
+        width = file.getsampwidth()
+        raw = file.readframes(file.getnframes())
+
+    if width != 2:
+        raise wave.Error(f"Unsupported sample width {width}")
+    samples = np.frombuffer(raw, dtype="<i2").reshape(-1, channels)
+    return samples, sample_rate
+
+def resample(audio, source_rate, target_rate=WHISPER_SAMPLE_RATE):
+
+    import numpy as np
+
+    if source_rate == target_rate:
+        return audio
+
+    # A box filter over one output sample's span keeps most aliasing out before linear interpolation
+    ratio = source_rate / target_rate
+    width = max(1, int(ratio))
+    if width > 1:
+        cumulative = np.concatenate(([0.0], np.cumsum(audio, dtype=np.float64)))
+        audio = ((cumulative[width:] - cumulative[:-width]) / width).astype(np.float32)
+
+    positions = np.arange(int(len(audio) / ratio)) * ratio
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+def speech_ranges(audio, sample_rate=WHISPER_SAMPLE_RATE, frame_sec=0.03, min_silence_sec=MIN_SILENCE_SEC, silence_db=SILENCE_DB, pad_sec=0.3):
+
+    import numpy as np
+
+    frame = int(sample_rate * frame_sec)
+    count = len(audio) // frame
+    if count == 0:
+        return [(0, len(audio))]
+
+    # Energy per 30 ms frame in one pass; silence is anything well below the loud end of this recording
+    energy = 10 * np.log10(np.mean(audio[:count * frame].reshape(count, frame) ** 2, axis=1) + 1e-10)
+    silent = energy < np.percentile(energy, 95) - silence_db
+
+    # Run boundaries of silent frames, as [start, end) frame indices
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2)
+    pad = int(pad_sec / frame_sec)
+    cuts = [(start + pad, end - pad) for start, end in runs if (end - start) * frame_sec >= min_silence_sec]
+
+    ranges = []
+    position = 0
+    for start, end in cuts:
+        ranges.append((position, start * frame))
+        position = end * frame
+    ranges.append((position, len(audio)))
+    return [(int(start), int(end)) for start, end in ranges if end > start]
+
+def load_audio(audio_path):
+
+    import numpy as np
+
+    # Mono float32 at Whisper's 16 kHz
+    samples, sample_rate = read_wav(audio_path)
+    return resample(samples.mean(axis=1, dtype=np.float32) / 32768, sample_rate)
+
+@traced("precondition_audio")
+def precondition_audio(audio_path, trim=True, samples=None):
+
+    import numpy as np
+
+    audio = load_audio(audio_path) if samples is None else samples
+
+    ranges = speech_ranges(audio) if trim else [(0, len(audio))]
+
+    # offsets: (start in trimmed audio, start in source audio) in seconds, one per kept range
+    offsets = []
+    trimmed = 0
+    for start, end in ranges:
+        offsets.append((trimmed / WHISPER_SAMPLE_RATE, start / WHISPER_SAMPLE_RATE))
+        trimmed += end - start
+
+    kept = np.concatenate([audio[start:end] for start, end in ranges]) if ranges else audio[:0]
+    current_span().set(audio_s=len(audio) / WHISPER_SAMPLE_RATE, kept_s=len(kept) / WHISPER_SAMPLE_RATE, cuts=len(ranges) - 1)
+    return kept, offsets
+
+def source_time(seconds, offsets, end=False):
+
+    # An end time that lands exactly on a cut belongs to the range before it, not after the removed silence
+    starts = [trimmed for trimmed, _ in offsets]
+    index = (bisect.bisect_left(starts, seconds) if end else bisect.bisect_right(starts, seconds)) - 1
+    trimmed, source = offsets[max(index, 0)]
+    return source + seconds - trimmed
+
+@traced("transcribe")
+def get_timestamped_transcript(audio_path, model_size=None, trim_silence=TRIM_SILENCE, profile=None, samples=None):
+
+    profile = profile or load_whisper_profile()
+    model_size = model_size or profile["model_size"]
+    model = get_whisper_model(model_size, profile["device"], profile["compute_type"], profile["cpu_threads"], profile["num_workers"])
+
+    # samples: the file already decoded by load_audio, so it isn't read again here
+    audio = audio_path if samples is None else samples
+    offsets = [(0.0, 0.0)]
+    if trim_silence:
+        try:
+            audio, offsets = precondition_audio(audio_path, samples=samples)
+        except (wave.Error, EOFError):
+            # Anything that isn't 16-bit PCM WAV goes to faster-whisper's own decoder untouched
+            pass
 
-    model = WhisperModel(model_size, device="cpu", compute_type="int8")
-    segments, _ = model.transcribe(audio_path, vad_filter=True, vad_parameters={"threshold": 0.5})
+    # Segments are decoded lazily, so the model stays busy until the list is built
+    with in_flight("neuroscope_whisper_busy"):
+        segments, _ = model.transcribe(audio, beam_size=profile["beam_size"], vad_filter=True, vad_parameters=profile["vad_parameters"])
+        transcript = [
+            {
+                "start": round(source_time(seg.start, offsets), 2),
+                "end": round(source_time(seg.end, offsets, end=True), 2),
+                "text": seg.text.strip()
+            }
+            for seg in segments
+        ]
 
-    return [
-        {
-            "start": round(seg.start, 2),
-            "end": round(seg.end, 2),
-            "text": seg.text.strip()
-        }
-        for seg in segments
-    ]
+    current_span().set(segments=len(transcript), bytes_in=os.path.getsize(audio_path), model=model_size)
+    return transcript
 
+@traced("transcript_structure")
 def transcript_structure(segments):
 
-    full_text=""
+    from utils.speaker_turns import INTERVIEWER, PATIENT, speaker_turns
 
-    for i in range(0, len(segments)-1, 2):
-        
-        question = segments[i]
-        answer = segments[i+1]
-        delay = round(answer['start'] - question['end'], 2)
+    # Unlabelled segments fall back to the old assumption that speakers strictly alternate
+    if segments and "speaker" not in segments[0]:
+        segments = [{**segment, "speaker": INTERVIEWER if i % 2 == 0 else PATIENT} for i, segment in enumerate(segments)]
 
-        full_text +=f"{question['text']}. {delay} seconds. {answer['text']}."
+    lines = []
+    previous = None
+    for turn in speaker_turns(segments):
+        if turn["speaker"] == PATIENT and previous is not None and previous["speaker"] == INTERVIEWER:
+            delay = round(turn["start"] - previous["end"], 2)
+            lines.append(f"{PATIENT} (after {delay} seconds): {turn['text']}")
+        else:
+            lines.append(f"{turn['speaker']}: {turn['text']}")
+        previous = turn
 
-    return full_text.strip()
+    return "\n".join(lines)
@@ -0,0 +1,227 @@
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from llm.findings import UNUSUAL, parse_findings
+from utils.tenants import DEFAULT_TENANT
+
+DEFAULT_STORE_PATH = os.environ.get("NEUROSCOPE_CASE_STORE", "neuroscope_cases.db")
+# Stored stage outputs older than this are deleted; saved cases are kept
+STAGE_OUTPUT_MAX_AGE = float(os.environ.get("NEUROSCOPE_STAGE_OUTPUT_MAX_AGE", 30 * 24 * 3600))
+PRUNE_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL DEFAULT 'default',
+    patient_id TEXT,
+    age INTEGER,
+    media_hash TEXT,
+    history TEXT,
+    history_analysis TEXT,
+    video_analysis TEXT,
+    audio_analysis TEXT,
+    diagnosis TEXT,
+    usage TEXT,
+    timings TEXT,
+    previous_case_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cases_created ON cases (created_at);
+CREATE INDEX IF NOT EXISTS cases_media ON cases (media_hash);
+CREATE TABLE IF NOT EXISTS findings (
+    case_id TEXT NOT NULL,
+    modality TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    status TEXT NOT NULL,
+    explanation TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_feature_status ON findings (feature, status, case_id);
+CREATE INDEX IF NOT EXISTS findings_case ON findings (case_id);
+CREATE TABLE IF NOT EXISTS stage_outputs (
+    stage TEXT NOT NULL,
+    input_key TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (stage, input_key)
+);
+CREATE INDEX IF NOT EXISTS stage_outputs_created ON stage_outputs (created_at);
+"""
+
+MODALITIES = (("history", "history_analysis"), ("vision", "video_analysis"), ("audio", "audio_analysis"))
+
+def input_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class CaseStore:
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_age=STAGE_OUTPUT_MAX_AGE):
+
+        self.path = path
+        self.max_age = max_age
+        self.pruned_at = 0.0
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+            # Stores created before follow-up visits existed lack the link column
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(cases)")}
+            if "previous_case_id" not in columns:
+                connection.execute("ALTER TABLE cases ADD COLUMN previous_case_id TEXT")
+            # Patient IDs are only unique within a clinic; older stores belong to the default tenant
+            if "tenant" not in columns:
+                connection.execute("ALTER TABLE cases ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+            connection.execute("DROP INDEX IF EXISTS cases_patient_created")
+            connection.execute("CREATE INDEX IF NOT EXISTS cases_tenant_patient_created ON cases (tenant, patient_id, created_at)")
+
+    @contextlib.contextmanager
+    def connect(self):
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def stage_output(self, stage, key):
+
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT output FROM stage_outputs WHERE stage = ? AND input_key = ?", (stage, key)
+            ).fetchone()
+        return json.loads(row["output"]) if row else None
+
+    def put_stage_output(self, stage, key, output):
+
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO stage_outputs (stage, input_key, output, created_at) VALUES (?, ?, ?, ?)",
+                (stage, key, json.dumps(output), time.time())
+            )
+        if time.time() - self.pruned_at > PRUNE_INTERVAL:
+            self.prune_stage_outputs()
+
+    def prune_stage_outputs(self):
+
+        self.pruned_at = time.time()
+        if not self.max_age:
+            return 0
+        with self.connect() as connection:
+            return connection.execute("DELETE FROM stage_outputs WHERE created_at < ?", (time.time() - self.max_age,)).rowcount
+
+    def save_case(self, result, payload, media_hash=None):
+
+        case_id = result["case_id"]
+        findings = [
+            finding
+            for modality, field in MODALITIES
+            for finding in parse_findings(result.get(field) or "", modality)
+        ]
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cases (id, tenant, patient_id, age, media_hash, history, history_analysis, video_analysis, "
+                    "audio_analysis, diagnosis, usage, timings, previous_case_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        case_id, payload.get("tenant") or DEFAULT_TENANT, payload.get("patient_id"), payload.get("age"), media_hash, payload.get("history"),
+                        result.get("history_analysis"), result.get("video_analysis"), result.get("audio_analysis"),
+                        result.get("diagnosis"), json.dumps(result.get("usage")), json.dumps(result.get("timings")),
+                        result.get("previous_case_id"), time.time()
+                    )
+                )
+                connection.execute("DELETE FROM findings WHERE case_id = ?", (case_id,))
+                connection.executemany(
+                    "INSERT INTO findings (case_id, modality, feature, status, explanation) VALUES (?, ?, ?, ?, ?)",
+                    [(case_id, finding.modality, finding.feature, finding.status, finding.explanation) for finding in findings]
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def get_case(self, case_id):
+
+        with self.connect() as connection:
+            row = connection.execute("SELECT * FROM cases WHERE id = ?", (case_id,)).fetchone()
+            if row is None:
+                return None
+            findings = connection.execute(
+                "SELECT modality, feature, status, explanation FROM findings WHERE case_id = ?", (case_id,)
+            ).fetchall()
+
+        case = dict(row)
+        case["usage"] = json.loads(case["usage"]) if case["usage"] else None
+        case["timings"] = json.loads(case["timings"]) if case["timings"] else None
+        case["findings"] = [dict(finding) for finding in findings]
+        return case
+
+    def latest_case(self, patient_id, tenant=None):
+
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT id FROM cases WHERE tenant = ? AND patient_id = ? ORDER BY created_at DESC LIMIT 1",
+                (tenant or DEFAULT_TENANT, patient_id)
+            ).fetchone()
+        return self.get_case(row["id"]) if row else None
+
+    def find_cases(self, patient_id=None, since=None, until=None, feature=None, status=UNUSUAL, limit=50, tenant=None):
+
+        # Summaries only; get_case loads the full record. A patient ID is always looked up within one clinic
+        query = "SELECT id, tenant, patient_id, age, created_at, diagnosis FROM cases WHERE 1 = 1"
+        params = []
+        if tenant is not None or patient_id is not None:
+            query += " AND tenant = ?"
+            params.append(tenant or DEFAULT_TENANT)
+        if patient_id is not None:
+            query += " AND patient_id = ?"
+            params.append(patient_id)
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND created_at < ?"
+            params.append(until)
+        if feature is not None:
+            query += " AND id IN (SELECT case_id FROM findings WHERE feature = ? AND status = ?)"
+            params.extend((feature, status))
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self.connect() as connection:
+            return [dict(row) for row in connection.execute(query, params).fetchall()]
+
+@functools.lru_cache(maxsize=1)
+def get_case_store(path=DEFAULT_STORE_PATH):
+    return CaseStore(path) if path else None
+
+if __name__ == "__main__":
+
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Look up stored NeuroScope assessments")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    parser.add_argument("--case", help="Print one case in full")
+    parser.add_argument("--tenant", help="Clinic; patient IDs are looked up within it")
+    parser.add_argument("--patient")
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--feature", help='Only cases where this feature was Unusual, e.g. "Eye Contact"')
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--prune", action="store_true", help="Delete stage outputs older than NEUROSCOPE_STAGE_OUTPUT_MAX_AGE")
+    args = parser.parse_args()
+
+    store = CaseStore(args.store)
+    if args.prune:
+        print(f"Deleted {store.prune_stage_outputs()} stage outputs")
+    elif args.case:
+        print(json.dumps(store.get_case(args.case), indent=2))
+    else:
+        since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+        for case in store.find_cases(args.patient, since, feature=args.feature, limit=args.limit, tenant=args.tenant):
+            created = datetime.fromtimestamp(case["created_at"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{created}  {case['id']}  tenant={case['tenant']}  patient={case['patient_id'] or '-'}  age={case['age']}")
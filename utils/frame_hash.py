@@ -0,0 +1,257 @@
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from utils.image_utils import sample_frames, encode_frame, tile_sheets, TILE_LAYOUT
+from utils.tracing import traced, current_span
+
+# "dhash" or "phash" turns deduplication on
+DEDUPE_METHOD = os.environ.get("NEUROSCOPE_FRAME_DEDUPE", "")
+DEDUPE_THRESHOLD = int(os.environ.get("NEUROSCOPE_DEDUPE_THRESHOLD", 3))
+DEDUPE_OVERSAMPLE = int(os.environ.get("NEUROSCOPE_DEDUPE_OVERSAMPLE", 3))
+FRAME_INDEX_PATH = os.environ.get("NEUROSCOPE_FRAME_INDEX", "")
+# Stored frames and selections not used for this long are deleted
+FRAME_INDEX_MAX_AGE = float(os.environ.get("NEUROSCOPE_FRAME_INDEX_MAX_AGE", 30 * 24 * 3600))
+PRUNE_INTERVAL = 3600
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id TEXT PRIMARY KEY,
+    block TEXT NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selections (
+    key TEXT PRIMARY KEY,
+    block_ids TEXT NOT NULL,
+    used_at REAL NOT NULL
+);
+"""
+
+def small_grayscale(frames, width, height):
+
+    import cv2
+    import numpy as np
+
+    return np.stack([
+        cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (width, height), interpolation=cv2.INTER_AREA)
+        for frame in frames
+    ]).astype(np.float32)
+
+def pack_bits(bits):
+
+    import numpy as np
+
+    # 64 booleans per frame become one big-endian uint64
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+def dct_matrix(size):
+
+    import numpy as np
+
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def dhash(frames):
+
+    gray = small_grayscale(frames, 9, 8)
+    return pack_bits(gray[:, :, 1:] > gray[:, :, :-1])
+
+def phash(frames):
+
+    import numpy as np
+
+    gray = small_grayscale(frames, 32, 32)
+    matrix = dct_matrix(32)
+    low = (matrix @ gray @ matrix.T)[:, :8, :8].reshape(len(gray), 64)
+    # The DC term only reflects brightness, so it's left out of the median
+    return pack_bits(low > np.median(low[:, 1:], axis=1, keepdims=True))
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+def hamming(a, b):
+
+    import numpy as np
+
+    xor = np.bitwise_xor(a[:, None], b[None, :])
+    return np.unpackbits(xor.view(np.uint8).reshape(len(a), len(b), 8), axis=2).sum(axis=2)
+
+def select_distinct(hashes, stride, threshold):
+
+    # Regularly spaced candidates keep their slot unless they repeat an earlier pick;
+    # freed slots go to whichever in-between candidate is most distinct from everything picked so far
+    distances = hamming(hashes, hashes)
+    slots = list(range(0, len(hashes), stride))
+
+    chosen = []
+    for index in slots:
+        if not chosen or distances[index, chosen].min() > threshold:
+            chosen.append(index)
+
+    remaining = [index for index in range(len(hashes)) if index not in chosen]
+    while remaining and len(chosen) < len(slots):
+        nearest = distances[remaining][:, chosen].min(axis=1)
+        best = int(nearest.argmax())
+        if nearest[best] <= threshold:
+            break
+        chosen.append(remaining.pop(best))
+
+    return sorted(chosen)
+
+class FrameIndex:
+
+    def __init__(self, path=FRAME_INDEX_PATH, max_age=FRAME_INDEX_MAX_AGE):
+
+        self.path = path
+        self.max_age = max_age
+        self.pruned_at = 0.0
+        with self.connect() as connection:
+            connection.executescript(INDEX_SCHEMA)
+            connection.execute("CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS selections_used ON selections (used_at)")
+
+    @contextlib.contextmanager
+    def connect(self):
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def blocks(self, block_ids):
+
+        with self.connect() as connection:
+            rows = connection.execute(
+                f"SELECT id, block FROM blocks WHERE id IN ({','.join('?' * len(block_ids))})", block_ids
+            ).fetchall()
+        found = {block_id: json.loads(block) for block_id, block in rows}
+        return [found.get(block_id) for block_id in block_ids]
+
+    def put_blocks(self, block_ids, blocks):
+
+        now = time.time()
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT INTO blocks (id, block, used_at) VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET used_at = excluded.used_at",
+                [(block_id, json.dumps(block), now) for block_id, block in zip(block_ids, blocks)]
+            )
+        self.maybe_prune()
+
+    def selection(self, key):
+
+        with self.connect() as connection:
+            row = connection.execute("SELECT block_ids FROM selections WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        block_ids = json.loads(row[0])
+        blocks = self.blocks(block_ids) if block_ids else []
+        if any(block is None for block in blocks):
+            return None
+        self.touch(key, block_ids)
+        return blocks
+
+    def touch(self, key, block_ids):
+
+        # Hits count as use, so a recording reprocessed regularly never ages out
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("UPDATE selections SET used_at = ? WHERE key = ?", (now, key))
+            connection.executemany("UPDATE blocks SET used_at = ? WHERE id = ?", [(now, block_id) for block_id in block_ids])
+
+    def put_selection(self, key, block_ids):
+
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO selections (key, block_ids, used_at) VALUES (?, ?, ?)",
+                (key, json.dumps(block_ids), time.time())
+            )
+        self.maybe_prune()
+
+    def maybe_prune(self):
+
+        if time.time() - self.pruned_at > PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+
+        self.pruned_at = time.time()
+        if not self.max_age:
+            return 0
+        cutoff = time.time() - self.max_age
+        with self.connect() as connection:
+            # A selection whose blocks are gone already misses, so the two tables can be pruned independently
+            selections = connection.execute("DELETE FROM selections WHERE used_at < ?", (cutoff,)).rowcount
+            return selections + connection.execute("DELETE FROM blocks WHERE used_at < ?", (cutoff,)).rowcount
+
+def block_id(media, block):
+
+    # Content digest scoped to the recording: an id only ever names these exact bytes from this media
+    digest = hashlib.sha256(block["source"]["data"].encode("utf-8")).hexdigest()
+    return f"{media}:{digest}"
+
+def encode_distinct(frames, timestamps, layout, media):
+
+    if layout is not None:
+        blocks = tile_sheets(frames, timestamps, layout)
+    else:
+        blocks = [encode_frame(frame) for frame in frames]
+    return [block_id(media, block) for block in blocks], blocks
+
+@traced("distinct_frames")
+def get_distinct_frames(video_path, max_frames=10, frame_interval_sec=3, start_sec=0, end_sec=None, layout=TILE_LAYOUT,
+                        method=None, threshold=DEDUPE_THRESHOLD, oversample=DEDUPE_OVERSAMPLE, index=None, key=None, media=None):
+
+    method = method or DEDUPE_METHOD or "dhash"
+    if index is not None and key is not None:
+        blocks = index.selection(key)
+        if blocks is not None:
+            current_span().set(cached=True, frames=len(blocks))
+            return blocks
+
+    # Sample oversample times as densely so dropped duplicates can be replaced from nearby moments
+    sampled = sample_frames(video_path, frame_interval_sec / oversample, start_sec, end_sec, max_frames * oversample)
+    if not sampled:
+        return []
+
+    timestamps, frames = zip(*sampled)
+    hashes = HASHES[method](frames)
+    chosen = select_distinct(hashes, oversample, threshold)
+
+    block_ids, blocks = encode_distinct(
+        [frames[i] for i in chosen], [timestamps[i] for i in chosen], layout, media or os.path.abspath(video_path)
+    )
+
+    if index is not None:
+        index.put_blocks(block_ids, blocks)
+        if key is not None:
+            index.put_selection(key, block_ids)
+
+    current_span().set(cached=False, candidates=len(frames), frames=len(chosen), bytes_out=sum(len(block["source"]["data"]) for block in blocks))
+    return blocks
+
+@functools.lru_cache(maxsize=1)
+def get_frame_index():
+
+    if not FRAME_INDEX_PATH:
+        return None
+    index = FrameIndex(FRAME_INDEX_PATH)
+    index.prune()
+    return index
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Delete frames and selections unused for NEUROSCOPE_FRAME_INDEX_MAX_AGE")
+    parser.add_argument("--index", default=FRAME_INDEX_PATH, required=not FRAME_INDEX_PATH)
+    args = parser.parse_args()
+
+    print(f"Deleted {FrameIndex(args.index).prune()} rows")
@@ -1,38 +1,118 @@
 import os
 import base64
-import cv2
+from utils.tracing import traced, current_span
+from utils.parallel_decode import DECODE_WORKERS, can_fork_workers, extract_frames_parallel, map_frames
+
+def parse_layout(value):
+
+    # "3x2" means 3 columns by 2 rows per contact sheet; empty disables tiling
+    if not value:
+        return None
+    columns, rows = value.lower().split("x")
+    return int(columns), int(rows)
+
+TILE_LAYOUT = parse_layout(os.environ.get("NEUROSCOPE_FRAME_TILING", ""))
+TILE_WIDTH = int(os.environ.get("NEUROSCOPE_TILE_WIDTH", 512))
+TILE_SHEETS = int(os.environ.get("NEUROSCOPE_TILE_SHEETS", 2))
+
+def get_video_duration(video_path):
+
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    return frames / fps if fps else 0.0
+
+def iter_sampled_frames(video_path, frame_interval_sec=3, start_sec=0, end_sec=None, max_frames=10):
+
+    import cv2
 
-def extract_frames(video_path, output_folder, frame_interval_sec=3):
-    
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    interval = int(fps * frame_interval_sec)
+    interval = max(1, int(fps * frame_interval_sec))
+    last_frame = int((end_sec - start_sec) * fps) if end_sec is not None else None
+
+    if start_sec:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start_sec * 1000)
 
     frame_count = 0
     saved = 0
 
-    while cap.isOpened():
-        
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if saved == 10:
-            break
-        if frame_count % interval == 0:
+    try:
+        while cap.isOpened():
+            
+            # grab() skips the colour conversion for frames that aren't sampled
+            if not cap.grab():
+                break
+            if saved == max_frames:
+                break
+            if last_frame is not None and frame_count >= last_frame:
+                break
+            if frame_count % interval == 0:
+
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                yield start_sec + frame_count / fps, frame
+                saved += 1
+
+            frame_count += 1
+    finally:
+        cap.release()
 
-            filename = os.path.join(output_folder, f"frame_{saved}.jpg")
-            cv2.imwrite(filename, frame)
-            saved += 1
+def sample_frames(video_path, frame_interval_sec=3, start_sec=0, end_sec=None, max_frames=10, workers=None):
 
-        frame_count += 1
+    # (seconds, frame) pairs held in memory, decoded across worker processes when NEUROSCOPE_DECODE_WORKERS allows
+    workers = DECODE_WORKERS if workers is None else workers
+    if workers > 1 and can_fork_workers():
+        # Frames arrive as views into the shared ring buffer, so each is copied before its slot is reused
+        return map_frames(video_path, lambda index, seconds, frame: (seconds, frame.copy()), frame_interval_sec, start_sec, end_sec, max_frames, workers)
+    return list(iter_sampled_frames(video_path, frame_interval_sec, start_sec, end_sec, max_frames))
+
+@traced("extract_frames")
+def extract_frames(video_path, output_folder, frame_interval_sec=3, start_sec=0, end_sec=None, max_frames=10, workers=None):
     
-    cap.release()
+    import cv2
+
+    workers = DECODE_WORKERS if workers is None else workers
+    if workers > 1 and can_fork_workers():
+        saved = extract_frames_parallel(video_path, output_folder, frame_interval_sec, start_sec, end_sec, max_frames, workers)
+        current_span().set(frames=saved, bytes_in=os.path.getsize(video_path), start_sec=start_sec, workers=workers)
+        return saved
+
+    saved = 0
+    for _, frame in iter_sampled_frames(video_path, frame_interval_sec, start_sec, end_sec, max_frames):
+        filename = os.path.join(output_folder, f"frame_{saved}.jpg")
+        cv2.imwrite(filename, frame)
+        saved += 1
+    
+    current_span().set(frames=saved, bytes_in=os.path.getsize(video_path), start_sec=start_sec)
     return saved
 
+def image_block(jpeg_bytes):
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/jpeg",
+            "data": base64.b64encode(jpeg_bytes).decode("utf-8")
+        }
+    }
+
+def encode_frame(frame, quality=95):
+
+    import cv2
+
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return image_block(encoded.tobytes())
+
 def encode_image_base64(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
+@traced("encode_frames")
 def get_encoded_frames(frame_dir, max_frames=10):
     
     image_blocks = []
@@ -52,4 +132,72 @@ def get_encoded_frames(frame_dir, max_frames=10):
             }
         })
 
+    current_span().set(frames=len(image_blocks), bytes_out=sum(len(block["source"]["data"]) for block in image_blocks))
+    return image_blocks
+
+def frame_budget(max_frames=10, layout=TILE_LAYOUT, sheets=TILE_SHEETS):
+
+    # With tiling on, the same number of image blocks carries columns * rows frames each
+    if layout is None:
+        return max_frames
+    return layout[0] * layout[1] * sheets
+
+def label_tile(tile, text):
+
+    import cv2
+
+    scale = tile.shape[1] / 640
+    thickness = max(1, round(2 * scale))
+    (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    tile[:height + baseline + 8, :width + 8] = 0
+    cv2.putText(tile, text, (4, height + 4), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+
+def compose_sheet(tiles, layout):
+
+    import numpy as np
+
+    columns, rows = layout
+    height, width = tiles[0].shape[:2]
+
+    # Pad to a full grid, then one reshape/transpose lays every tile out at once
+    grid = np.zeros((rows * columns, height, width, 3), dtype=np.uint8)
+    grid[:len(tiles)] = np.stack(tiles)
+    return grid.reshape(rows, columns, height, width, 3).transpose(0, 2, 1, 3, 4).reshape(rows * height, columns * width, 3)
+
+def tile_sheets(frames, timestamps, layout=(3, 2), tile_width=TILE_WIDTH, quality=85):
+
+    import cv2
+
+    tiles = []
+    for frame, seconds in zip(frames, timestamps):
+        tile_height = round(frame.shape[0] * tile_width / frame.shape[1])
+        tile = cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+        label_tile(tile, f"{int(seconds // 60)}:{int(seconds % 60):02d}")
+        tiles.append(tile)
+
+    per_sheet = layout[0] * layout[1]
+    return [encode_frame(compose_sheet(tiles[start:start + per_sheet], layout), quality) for start in range(0, len(tiles), per_sheet)]
+
+@traced("tile_frames")
+def get_tiled_frames(frame_dir, max_frames=10, layout=(3, 2), tile_width=TILE_WIDTH, frame_interval_sec=3, start_sec=0, quality=85):
+
+    import cv2
+
+    frames = []
+    for i in range(max_frames):
+        frame_path = os.path.join(frame_dir, f"frame_{i}.jpg")
+        if not os.path.exists(frame_path):
+            break
+        frames.append(cv2.imread(frame_path))
+
+    timestamps = [start_sec + i * frame_interval_sec for i in range(len(frames))]
+    image_blocks = tile_sheets(frames, timestamps, layout, tile_width, quality)
+
+    current_span().set(frames=len(frames), sheets=len(image_blocks), bytes_out=sum(len(block["source"]["data"]) for block in image_blocks))
     return image_blocks
+
+def encode_frames(frame_dir, max_frames=10, frame_interval_sec=3, start_sec=0, layout=TILE_LAYOUT):
+
+    if layout is None:
+        return get_encoded_frames(frame_dir, max_frames)
+    return get_tiled_frames(frame_dir, max_frames, layout, frame_interval_sec=frame_interval_sec, start_sec=start_sec)
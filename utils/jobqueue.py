@@ -0,0 +1,335 @@
+import atexit
+import contextlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from utils.tenants import DEFAULT_TENANT, get_tenant_usage, tenant_quota
+from utils.metrics import METRICS_PORT, add_collector, inc, observe, pid_alive, set_gauge, start_metrics_server
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_QUEUE_PATH = os.environ.get("NEUROSCOPE_QUEUE_PATH", "neuroscope_jobs.db")
+REQUEUE_INTERVAL = float(os.environ.get("NEUROSCOPE_REQUEUE_INTERVAL", 30))
+# A job whose worker has died this many times is failed rather than handed to another worker
+MAX_ATTEMPTS = int(os.environ.get("NEUROSCOPE_MAX_ATTEMPTS", 3))
+SUPERVISE_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    tenant TEXT NOT NULL DEFAULT 'default',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);
+"""
+
+class JobQueue:
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+
+        self.path = path
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+            # Queues created before tenants existed lack the column; their jobs belong to the default tenant
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "tenant" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+            if "attempts" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_tenant_created ON jobs (status, tenant, created_at)")
+
+    @contextlib.contextmanager
+    def connect(self):
+
+        # One short-lived connection per call keeps this safe across threads and processes
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def submit(self, payload, job_id=None):
+
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, stage, payload, tenant, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, QUEUED, json.dumps(payload), payload.get("tenant") or DEFAULT_TENANT, now, now)
+            )
+            connection.execute("INSERT INTO job_events (job_id, stage, at) VALUES (?, ?, ?)", (job_id, QUEUED, now))
+        return job_id
+
+    def next_job(self, connection):
+
+        # Workers go to the tenant using the smallest weighted share of them, oldest job first, so one clinic's
+        # backlog can't occupy every worker; tenants at their concurrency quota wait even if workers are free
+        running = dict(connection.execute("SELECT tenant, COUNT(*) FROM jobs WHERE status = ? GROUP BY tenant", (RUNNING,)).fetchall())
+        candidates = []
+        for name, oldest in connection.execute("SELECT tenant, MIN(created_at) FROM jobs WHERE status = ? GROUP BY tenant", (QUEUED,)):
+            quota = tenant_quota(name)
+            active = running.get(name, 0)
+            if not quota["max_concurrent"] or active < quota["max_concurrent"]:
+                candidates.append((active / quota["weight"], oldest, name))
+        if not candidates:
+            return None
+
+        _, _, name = min(candidates)
+        return connection.execute(
+            "SELECT id, payload FROM jobs WHERE status = ? AND tenant = ? ORDER BY created_at LIMIT 1", (QUEUED, name)
+        ).fetchone()
+
+    def claim(self):
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.next_job(connection)
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (RUNNING, os.getpid(), time.time(), row["id"])
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        return row["id"], json.loads(row["payload"])
+
+    def update_stage(self, job_id, stage):
+
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?", (stage, now, job_id))
+            connection.execute("INSERT INTO job_events (job_id, stage, at) VALUES (?, ?, ?)", (job_id, stage, now))
+
+    def finish(self, job_id, status, result=None, error=None):
+
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, status, json.dumps(result) if result is not None else None, error, now, job_id)
+            )
+            connection.execute("INSERT INTO job_events (job_id, stage, at) VALUES (?, ?, ?)", (job_id, status, now))
+
+    def get(self, job_id):
+
+        with self.connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def events(self, job_id, after=0):
+
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT id, stage, at FROM job_events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, after)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def media_in_use(self):
+
+        with self.connect() as connection:
+            rows = connection.execute("SELECT payload FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        return {json.loads(row["payload"]).get("video_path") for row in rows} - {None}
+
+    def depth(self):
+
+        with self.connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def requeue_orphaned(self, dead_pids=()):
+
+        # Running jobs whose worker process has died go back to the front of the queue; a slow job with a live worker is left alone.
+        # dead_pids are workers a supervisor has seen exit; other pids are probed, which can't see a worker in another supervisor's pool
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute("SELECT id, worker_pid, attempts, tenant, created_at FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+                orphaned = [row for row in rows if row["worker_pid"] is None or row["worker_pid"] in dead_pids or not pid_alive(row["worker_pid"])]
+                requeued = [row["id"] for row in orphaned if row["attempts"] < MAX_ATTEMPTS]
+                failed = [row for row in orphaned if row["attempts"] >= MAX_ATTEMPTS]
+                connection.executemany(
+                    "UPDATE jobs SET status = ?, stage = ?, worker_pid = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                    [(QUEUED, QUEUED, now, job_id, RUNNING) for job_id in requeued]
+                )
+                connection.executemany(
+                    "UPDATE jobs SET status = ?, stage = ?, error = ?, worker_pid = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                    [(FAILED, FAILED, f"Worker exited while running this job {row['attempts']} times", now, row["id"], RUNNING) for row in failed]
+                )
+                connection.executemany(
+                    "INSERT INTO job_events (job_id, stage, at) VALUES (?, ?, ?)",
+                    [(job_id, QUEUED, now) for job_id in requeued] + [(row["id"], FAILED, now) for row in failed]
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        usage = get_tenant_usage()
+        for row in failed:
+            inc("neuroscope_cases_total", status=FAILED)
+            if usage is not None:
+                usage.record_case(row["tenant"], row["id"], FAILED, row["created_at"])
+        return len(orphaned)
+
+def publish_depth(queue):
+
+    def collector():
+        depth = queue.depth()
+        for status in (QUEUED, RUNNING):
+            set_gauge("neuroscope_jobs", depth.get(status, 0), status=status)
+
+    add_collector(collector)
+
+def worker_loop(path, poll_interval=1.0, parent_pid=None):
+
+    from pipeline import Agents, run_case
+
+    queue = JobQueue(path)
+    agents = Agents()
+    usage = get_tenant_usage()
+    last_requeue = 0.0
+
+    while True:
+
+        # Workers aren't daemonic (so they can start decode processes) and must not outlive the app that started them
+        if parent_pid is not None and os.getppid() != parent_pid:
+            return
+
+        if time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+            queue.requeue_orphaned()
+            last_requeue = time.monotonic()
+
+        claimed = queue.claim()
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+
+        job_id, payload = claimed
+        started_at = time.time()
+        try:
+            # The job id doubles as the case id, so tenant usage and reservations line up with the queue
+            result = run_case(agents, {**payload, "case_id": payload.get("case_id") or job_id}, lambda stage: queue.update_stage(job_id, stage))
+        except Exception as error:
+            queue.finish(job_id, FAILED, error=f"{type(error).__name__}: {error}")
+            result = None
+        else:
+            queue.finish(job_id, DONE, result=result)
+
+        job = queue.get(job_id)
+        inc("neuroscope_cases_total", status=job["status"])
+        observe("neuroscope_case_duration_seconds", time.time() - job["created_at"])
+        if usage is not None:
+            usage.record_case(
+                job["tenant"], job_id, job["status"], job["created_at"], started_at,
+                result and result["usage"], result and result["timings"]
+            )
+
+class WorkerPool:
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, count=2):
+
+        self.path = path
+        self.queue = JobQueue(path)
+        self.stopping = threading.Event()
+        self.queue.requeue_orphaned()
+        self.workers = [self.spawn() for _ in range(count)]
+
+    def spawn(self):
+
+        # Not daemonic, so parallel frame decoding can start its own processes; stopped explicitly at exit instead
+        worker = multiprocessing.Process(target=worker_loop, args=(self.path, 1.0, os.getpid()))
+        worker.start()
+        return worker
+
+    def check(self):
+
+        # The handle knows a worker has exited even before it is reaped, when probing its pid still finds the zombie
+        dead = []
+        for index, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            worker.join()
+            dead.append(worker.pid)
+            if not self.stopping.is_set():
+                self.workers[index] = self.spawn()
+        if dead:
+            self.queue.requeue_orphaned(dead)
+        return dead
+
+    def supervise(self, interval=SUPERVISE_INTERVAL):
+
+        while not self.stopping.wait(interval):
+            self.check()
+
+    def stop(self):
+
+        self.stopping.set()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            worker.join(timeout=5)
+
+def start_workers(path=DEFAULT_QUEUE_PATH, count=2):
+
+    pool = WorkerPool(path, count)
+    threading.Thread(target=pool.supervise, daemon=True, name="neuroscope-worker-supervisor").start()
+    atexit.register(pool.stop)
+    return pool
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run NeuroScope diagnosis workers against the local job queue")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Serve Prometheus metrics on this port (0 to disable)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        publish_depth(JobQueue(args.queue))
+        start_metrics_server(args.metrics_port)
+
+    pool = start_workers(args.queue, args.workers)
+    try:
+        pool.stopping.wait()
+    except KeyboardInterrupt:
+        pool.stop()
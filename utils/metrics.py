@@ -0,0 +1,404 @@
+import atexit
+import contextlib
+import json
+import multiprocessing.util
+import os
+import sys
+import tempfile
+import threading
+import time
+from utils.tracing import add_listener
+
+# POSIX-only; on Windows snapshot merges aren't locked and resident memory isn't reported
+try:
+    import fcntl
+    import resource
+except ImportError:
+    fcntl = resource = None
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), "neuroscope_metrics")
+METRICS_PORT = int(os.environ.get("NEUROSCOPE_METRICS_PORT") or 0)
+# Only local scrapers by default; set 0.0.0.0 to expose the counters on every interface
+METRICS_HOST = os.environ.get("NEUROSCOPE_METRICS_HOST", "127.0.0.1")
+# Snapshots are only written when something serves them; enable_snapshots turns them on for an endpoint started later
+METRICS_DIR = os.environ.get("NEUROSCOPE_METRICS_DIR") or (DEFAULT_METRICS_DIR if METRICS_PORT else "")
+RETIRED_NAME = "retired.json"
+FLUSH_INTERVAL = float(os.environ.get("NEUROSCOPE_METRICS_FLUSH_SEC", 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+METRICS = {
+    "neuroscope_stage_duration_seconds": ("histogram", "Duration of traced stages: frame and audio extraction, transcription, agents, MCP tools"),
+    "neuroscope_stage_errors_total": ("counter", "Traced stages that raised"),
+    "neuroscope_case_duration_seconds": ("histogram", "Submission to completion time of a case"),
+    "neuroscope_cases_total": ("counter", "Finished cases by outcome"),
+    "neuroscope_cases_in_progress": ("gauge", "Cases admitted by the HTTP API and not yet finished"),
+    "neuroscope_jobs": ("gauge", "Job queue entries by status"),
+    "neuroscope_stage_active": ("gauge", "Calls running in an HTTP API stage"),
+    "neuroscope_stage_waiting": ("gauge", "Calls queued for an HTTP API stage"),
+    "neuroscope_llm_tokens_total": ("counter", "LLM tokens by agent and kind"),
+    "neuroscope_llm_retries_total": ("counter", "LLM attempts retried after throttling or transient errors"),
+    "neuroscope_llm_queue_seconds": ("histogram", "Time LLM calls waited for rate-limit capacity"),
+    "neuroscope_llm_waiting": ("gauge", "LLM calls waiting in the request scheduler"),
+    "neuroscope_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "neuroscope_whisper_models_loaded": ("gauge", "Whisper models held in memory"),
+    "neuroscope_whisper_busy": ("gauge", "Transcriptions running"),
+    "neuroscope_process_resident_memory_bytes": ("gauge", "Resident memory per process"),
+}
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def current_rss_bytes():
+
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        if resource is None:
+            return None
+        # No procfs, so fall back to the peak; ru_maxrss is bytes on macOS and kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class Registry:
+
+    def __init__(self):
+
+        self.samplers = []
+        self.reset()
+
+    def reset(self):
+
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.flusher_pid = None
+        self.flush_lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+
+        with self.lock:
+            key = (name, label_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self.ensure_flusher()
+
+    def set(self, name, value, **labels):
+
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+        self.ensure_flusher()
+
+    def add(self, name, amount, **labels):
+
+        with self.lock:
+            key = (name, label_key(labels))
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+        self.ensure_flusher()
+
+    def observe(self, name, value, **labels):
+
+        with self.lock:
+            # Per-bucket counts, then the overflow bucket, sum and count; made cumulative when rendered
+            entry = self.histograms.setdefault((name, label_key(labels)), [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0])
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS))
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+        self.ensure_flusher()
+
+    def add_sampler(self, sampler):
+
+        # Samplers set point-in-time gauges for this process (forked children keep them) before its metrics are read
+        self.samplers.append(sampler)
+
+    def add_collector(self, collector):
+
+        # Collectors report deployment-wide state such as queue depth, only from the process serving the endpoint
+        self.collectors.append(collector)
+
+    def sample(self, collectors=False):
+
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.set("neuroscope_process_resident_memory_bytes", rss, pid=os.getpid())
+        for sampler in self.samplers + (self.collectors if collectors else []):
+            try:
+                sampler()
+            except Exception:
+                pass
+
+    def snapshot(self):
+
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                "histograms": [[name, list(labels), list(entry)] for (name, labels), entry in self.histograms.items()]
+            }
+
+    def ensure_flusher(self):
+
+        # Each process publishes its own file, so job workers and media pools show up on one endpoint
+        if not METRICS_DIR or self.flusher_pid == os.getpid():
+            return
+        self.flusher_pid = os.getpid()
+        threading.Thread(target=self.flush_loop, daemon=True, name="neuroscope-metrics").start()
+        # multiprocessing children skip atexit but run these finalizers when they exit normally
+        atexit.register(self.retire)
+        multiprocessing.util.Finalize(None, self.retire, exitpriority=0)
+
+    def flush_loop(self):
+
+        while self.flusher_pid == os.getpid():
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+
+        self.sample()
+        with self.flush_lock:
+            if self.flusher_pid != os.getpid():
+                return
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            write_snapshot(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), self.snapshot())
+
+    def retire(self):
+
+        # On exit the counters and histograms are folded into one shared file and this process's own file is removed
+        with self.flush_lock:
+            if self.flusher_pid != os.getpid():
+                return
+            self.flusher_pid = None
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(os.path.join(METRICS_DIR, "retired.lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                retired_path = os.path.join(METRICS_DIR, RETIRED_NAME)
+                snapshots = [self.snapshot()] + [snapshot for snapshot in [read_snapshot(retired_path)] if snapshot]
+                counters, _, histograms = merge_snapshots(snapshots, live=False)
+                write_snapshot(retired_path, {
+                    "pid": None,
+                    "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+                    "gauges": [],
+                    "histograms": [[name, list(labels), entry] for (name, labels), entry in histograms.items()]
+                })
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(METRICS_DIR, f"{os.getpid()}.json"))
+
+def write_snapshot(path, snapshot):
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(snapshot, file)
+    os.replace(temp_path, path)
+
+def read_snapshot(path):
+
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def merge_snapshots(snapshots, live=True):
+
+    # Counters and histograms keep counting after a worker exits; gauges only describe live processes
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        alive = live and (snapshot["pid"] == os.getpid() or (snapshot["pid"] is not None and pid_alive(snapshot["pid"])))
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot["gauges"] if alive else ():
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, entry in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(entry))
+            histograms[key] = [total + value for total, value in zip(merged, entry)]
+    return counters, gauges, histograms
+
+REGISTRY = Registry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+def inc(name, amount=1, **labels):
+    REGISTRY.inc(name, amount, **labels)
+
+def set_gauge(name, value, **labels):
+    REGISTRY.set(name, value, **labels)
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+def add_sampler(sampler):
+    REGISTRY.add_sampler(sampler)
+
+def add_collector(collector):
+    REGISTRY.add_collector(collector)
+
+@contextlib.contextmanager
+def in_flight(name, **labels):
+
+    REGISTRY.add(name, 1, **labels)
+    try:
+        yield
+    finally:
+        REGISTRY.add(name, -1, **labels)
+
+def cache_lookup(cache, hit):
+    REGISTRY.inc("neuroscope_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def record_span(span):
+
+    observe("neuroscope_stage_duration_seconds", span.duration, stage=span.name)
+    if span.error is not None:
+        inc("neuroscope_stage_errors_total", stage=span.name)
+
+    attributes = span.attributes
+    if span.name.startswith("llm."):
+        agent = span.name[len("llm."):]
+        for kind in ("input", "output", "cache_creation_input", "cache_read_input"):
+            if attributes.get(f"{kind}_tokens"):
+                inc("neuroscope_llm_tokens_total", attributes[f"{kind}_tokens"], agent=agent, kind=kind)
+        if attributes.get("retries"):
+            inc("neuroscope_llm_retries_total", attributes["retries"], agent=agent)
+        if "queued_s" in attributes:
+            observe("neuroscope_llm_queue_seconds", attributes["queued_s"], agent=agent)
+    elif span.name == "distinct_frames" and "cached" in attributes:
+        cache_lookup("frame_index", attributes["cached"])
+
+add_listener(record_span)
+
+def windows_pid_alive(pid):
+
+    # os.kill(pid, 0) would terminate the process on Windows, so ask for its exit code instead
+    import ctypes
+
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: it exists but belongs to someone else
+    try:
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        return code.value == 259  # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+def pid_alive(pid):
+
+    if sys.platform == "win32":
+        return windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # An exited child that nobody has reaped still answers signals; procfs shows it as a zombie
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            return file.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+def enable_snapshots(directory=None):
+
+    # Child processes started from here inherit the setting, whether they fork or re-import this module
+    global METRICS_DIR
+    METRICS_DIR = directory or METRICS_DIR or DEFAULT_METRICS_DIR
+    os.environ["NEUROSCOPE_METRICS_DIR"] = METRICS_DIR
+    return METRICS_DIR
+
+def clear_stale():
+
+    # Files left by processes from earlier runs; called once when an endpoint starts
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        stem = name.split(".")[0]
+        if (stem.isdigit() and not pid_alive(int(stem))) or name == RETIRED_NAME:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(METRICS_DIR, name))
+
+def collect():
+
+    REGISTRY.sample(collectors=True)
+    snapshots = [REGISTRY.snapshot()]
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            snapshot = read_snapshot(os.path.join(METRICS_DIR, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return merge_snapshots(snapshots)
+
+def format_labels(labels, extra=()):
+
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def render():
+
+    counters, gauges, histograms = collect()
+    by_name = {}
+    for series in (counters, gauges, histograms):
+        for name, labels in series:
+            by_name.setdefault(name, []).append(labels)
+
+    lines = []
+    for name in sorted(by_name):
+        kind, description = METRICS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels in sorted(by_name[name]):
+            key = (name, labels)
+            if key in histograms:
+                entry = histograms[key]
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), entry[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {entry[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} {entry[-1]}")
+            else:
+                lines.append(f"{name}{format_labels(labels)} {counters.get(key, gauges.get(key))}")
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    enable_snapshots()
+    clear_stale()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="neuroscope-metrics-http").start()
+    return server
@@ -0,0 +1,159 @@
+import math
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+DECODE_WORKERS = int(os.environ.get("NEUROSCOPE_DECODE_WORKERS", 0))
+
+def video_info(video_path):
+
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    info = (
+        cap.get(cv2.CAP_PROP_FPS),
+        cap.get(cv2.CAP_PROP_FRAME_COUNT),
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    )
+    cap.release()
+    return info
+
+def decode_worker(video_path, shm_name, shape, fps, tasks, free_slots, ready):
+
+    import cv2
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    cap = cv2.VideoCapture(video_path)
+
+    try:
+        while (samples := tasks.get()) is not None:
+
+            # One seek per range, then grab() forward so frames between samples are never converted
+            position = round(samples[0][1] * fps)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+
+            for index, seconds in samples:
+
+                target = round(seconds * fps)
+                while position < target and cap.grab():
+                    position += 1
+                ok, frame = cap.read()
+                position += 1
+                if not ok:
+                    break
+
+                slot = free_slots.get()
+                if frame.shape != shape[1:]:
+                    frame = cv2.resize(frame, (shape[2], shape[1]))
+                frames[slot] = frame
+                ready.put((slot, index, seconds))
+    finally:
+        cap.release()
+        del frames
+        shm.close()
+        ready.put(None)
+
+def map_frames(video_path, func, frame_interval_sec=3, start_sec=0, end_sec=None, max_frames=None, workers=None, slots=None, threads=None):
+
+    import numpy as np
+
+    fps, frame_count, width, height = video_info(video_path)
+    if not fps or not width:
+        return []
+
+    duration = frame_count / fps
+    end_sec = min(end_sec, duration) if end_sec is not None else duration
+    count = max(0, math.ceil((end_sec - start_sec) / frame_interval_sec))
+    if max_frames is not None:
+        count = min(count, max_frames)
+    if count == 0:
+        return []
+
+    workers = min(workers or os.cpu_count() or 1, count)
+    slots = slots or workers * 4
+    threads = threads or workers
+    shape = (slots, height, width, 3)
+
+    # Contiguous ranges keep seeks rare; a few per worker evens out codecs with uneven decode cost
+    samples = [(index, start_sec + index * frame_interval_sec) for index in range(count)]
+    per_range = max(1, math.ceil(count / (workers * 4)))
+    ranges = [samples[start:start + per_range] for start in range(0, count, per_range)]
+
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    tasks, free_slots, ready = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Queue()
+
+    for slot in range(slots):
+        free_slots.put(slot)
+    for samples_range in ranges:
+        tasks.put(samples_range)
+    for _ in range(workers):
+        tasks.put(None)
+
+    processes = [
+        multiprocessing.Process(target=decode_worker, args=(video_path, shm.name, shape, fps, tasks, free_slots, ready), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def consume(slot, index, seconds):
+
+        # The frame is a view into shared memory and only valid until its slot goes back to the ring
+        try:
+            return index, func(index, seconds, frames[slot])
+        finally:
+            free_slots.put(slot)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = []
+            finished = 0
+            while finished < workers:
+                try:
+                    message = ready.get(timeout=1)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError("Frame decode workers exited without finishing")
+                    continue
+                if message is None:
+                    finished += 1
+                    continue
+                futures.append(executor.submit(consume, *message))
+            results = [future.result() for future in futures]
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        del frames
+        shm.close()
+        shm.unlink()
+
+    return [result for _, result in sorted(results, key=lambda item: item[0])]
+
+def can_fork_workers():
+
+    # Daemonic processes (multiprocessing.Pool workers, for example) aren't allowed children
+    return not multiprocessing.current_process().daemon
+
+def extract_frames_parallel(video_path, output_folder, frame_interval_sec=3, start_sec=0, end_sec=None, max_frames=10, workers=None):
+
+    import cv2
+
+    def write(index, seconds, frame):
+        path = os.path.join(output_folder, f"sample_{index}.jpg")
+        cv2.imwrite(path, frame)
+        return path
+
+    # Renamed in time order afterwards so a failed read never leaves a gap in frame_0, frame_1, ...
+    paths = map_frames(video_path, write, frame_interval_sec, start_sec, end_sec, max_frames, workers)
+    for saved, path in enumerate(paths):
+        os.replace(path, os.path.join(output_folder, f"frame_{saved}.jpg"))
+    return len(paths)
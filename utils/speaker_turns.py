@@ -0,0 +1,117 @@
+from utils.audio_utils import WHISPER_SAMPLE_RATE
+from utils.tracing import traced, current_span
+
+INTERVIEWER = "Interviewer"
+PATIENT = "Patient"
+
+FFT_SIZE = 512
+HOP = 160
+MEL_BANDS = 40
+CEPSTRA = 13
+
+def mel_filterbank(bands=MEL_BANDS, fft_size=FFT_SIZE, sample_rate=WHISPER_SAMPLE_RATE):
+
+    import numpy as np
+
+    def to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    edges = to_hz(np.linspace(to_mel(0), to_mel(sample_rate / 2), bands + 2))
+    bins = np.fft.rfftfreq(fft_size, 1 / sample_rate)
+
+    # Triangles rising from each lower edge to the centre and falling to the upper edge
+    lower, centre, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (centre - lower)
+    falling = (upper - bins) / (upper - centre)
+    return np.maximum(0, np.minimum(rising, falling))
+
+def cepstra(audio, filterbank):
+
+    import numpy as np
+
+    if len(audio) < FFT_SIZE:
+        audio = np.pad(audio, (0, FFT_SIZE - len(audio)))
+
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FFT_SIZE)[::HOP] * np.hamming(FFT_SIZE)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    log_mel = np.log(power @ filterbank.T + 1e-10)
+
+    bands = filterbank.shape[0]
+    basis = np.cos(np.pi * np.arange(CEPSTRA)[:, None] * (np.arange(bands)[None, :] + 0.5) / bands)
+    return log_mel @ basis.T
+
+def segment_embeddings(audio, segments, sample_rate=WHISPER_SAMPLE_RATE):
+
+    import numpy as np
+
+    filterbank = mel_filterbank(sample_rate=sample_rate)
+    embeddings = []
+    for segment in segments:
+        start = int(segment["start"] * sample_rate)
+        end = max(int(segment["end"] * sample_rate), start + 1)
+        features = cepstra(audio[start:end], filterbank)[:, 1:]
+        # c0 is overall loudness, which depends on distance to the mic more than on who is talking
+        embeddings.append(np.concatenate((features.mean(axis=0), features.std(axis=0))))
+    return np.array(embeddings)
+
+def two_means(points, weights, iterations=25):
+
+    import numpy as np
+
+    # Seeded with the first segment and the one farthest from it, so runs are deterministic
+    first = points[0]
+    centres = np.stack((first, points[np.argmax(((points - first) ** 2).sum(axis=1))]))
+
+    labels = np.zeros(len(points), dtype=int)
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        new_labels = distances.argmin(axis=1)
+        if _ and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for cluster in (0, 1):
+            members = labels == cluster
+            if members.any():
+                centres[cluster] = np.average(points[members], axis=0, weights=weights[members])
+    return labels
+
+@traced("speaker_turns")
+def label_speakers(segments, audio, sample_rate=WHISPER_SAMPLE_RATE):
+
+    import numpy as np
+
+    if len(segments) < 2:
+        return [{**segment, "speaker": INTERVIEWER} for segment in segments]
+
+    # audio: mono samples the caller already decoded for transcription
+    embeddings = segment_embeddings(audio, segments, sample_rate)
+    embeddings = (embeddings - embeddings.mean(axis=0)) / (embeddings.std(axis=0) + 1e-6)
+    weights = np.array([max(segment["end"] - segment["start"], 0.1) for segment in segments])
+    labels = two_means(embeddings, weights)
+
+    # The interviewer is whoever asks more questions; ties go to whoever spoke first
+    question_share = [
+        np.mean([segment["text"].rstrip().endswith("?") for segment, label in zip(segments, labels) if label == cluster] or [0])
+        for cluster in (0, 1)
+    ]
+    interviewer = labels[0]
+    if question_share[0] != question_share[1]:
+        interviewer = int(np.argmax(question_share))
+
+    current_span().set(segments=len(segments), audio_s=len(audio) / sample_rate)
+    return [{**segment, "speaker": INTERVIEWER if label == interviewer else PATIENT} for segment, label in zip(segments, labels)]
+
+def speaker_turns(segments):
+
+    # Consecutive segments from the same speaker form one turn
+    turns = []
+    for segment in segments:
+        if turns and turns[-1]["speaker"] == segment["speaker"]:
+            turns[-1]["end"] = segment["end"]
+            turns[-1]["text"] = f"{turns[-1]['text']} {segment['text']}".strip()
+        else:
+            turns.append({"speaker": segment["speaker"], "start": segment["start"], "end": segment["end"], "text": segment["text"]})
+    return turns
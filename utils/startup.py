@@ -0,0 +1,62 @@
+import argparse
+import json
+import subprocess
+import sys
+
+DEFAULT_MODULES = ("pipeline", "batch", "server", "utils.jobqueue", "utils.DSM5MCP")
+
+def profile_imports(module):
+
+    # -X importtime reports every import to stderr; a fresh interpreter keeps results independent
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+
+    timings = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue
+        timings.append({
+            "module": fields[2].strip(),
+            "self_ms": int(fields[0]) / 1000,
+            "cumulative_ms": int(fields[1]) / 1000
+        })
+
+    error = None
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}"
+
+    total = next((timing["cumulative_ms"] for timing in timings if timing["module"] == module), None)
+    return {"module": module, "total_ms": total, "error": error, "imports": timings}
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Report import time per module for NeuroScope entry points")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list per module")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    reports = []
+    for module in args.modules:
+        report = profile_imports(module)
+        report["imports"] = sorted(report["imports"], key=lambda timing: timing["cumulative_ms"], reverse=True)[:args.top]
+        reports.append(report)
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    for report in reports:
+        status = f"failed: {report['error']}" if report["error"] else f"{report['total_ms']:.1f} ms"
+        print(f"{report['module']}: {status}")
+        for timing in report["imports"]:
+            print(f"    {timing['cumulative_ms']:10.1f} ms  {timing['self_ms']:8.1f} ms self  {timing['module']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+DEFAULT_TENANT = "default"
+
+TENANTS_PATH = os.environ.get("NEUROSCOPE_TENANTS", "tenants.json")
+DEFAULT_USAGE_PATH = os.environ.get("NEUROSCOPE_TENANT_USAGE", "neuroscope_tenants.db")
+# Tokens held for a case in flight until the tenant has finished cases to average over
+CASE_TOKEN_ESTIMATE = int(os.environ.get("NEUROSCOPE_CASE_TOKEN_ESTIMATE", 20000))
+
+# weight: share of contended capacity; max_concurrent: cases in flight; tokens per minute and per day; 0 means no limit
+DEFAULT_QUOTA = {"weight": 1.0, "max_concurrent": 0, "tokens_per_minute": 0, "tokens_per_day": 0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tenant_cases (
+    case_id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS tenant_cases_tenant_finished ON tenant_cases (tenant, finished_at);
+CREATE INDEX IF NOT EXISTS tenant_cases_finished ON tenant_cases (finished_at);
+CREATE TABLE IF NOT EXISTS tenant_reservations (
+    case_id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tenant_reservations_tenant ON tenant_reservations (tenant, created_at);
+"""
+
+_tenant = contextvars.ContextVar("neuroscope_tenant", default=DEFAULT_TENANT)
+
+class QuotaExceeded(Exception):
+    pass
+
+@contextlib.contextmanager
+def tenant(name):
+
+    token = _tenant.set(name or DEFAULT_TENANT)
+    try:
+        yield _tenant.get()
+    finally:
+        _tenant.reset(token)
+
+def get_tenant():
+    return _tenant.get()
+
+@functools.lru_cache(maxsize=1)
+def load_tenants(path=TENANTS_PATH):
+
+    # {"clinic-a": {"weight": 2, "max_concurrent": 4}, "default": {...}}; the "default" entry applies to unlisted tenants
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def tenant_quota(name):
+
+    tenants = load_tenants()
+    return {**DEFAULT_QUOTA, **tenants.get(DEFAULT_TENANT, {}), **tenants.get(name or DEFAULT_TENANT, {})}
+
+def percentile(values, fraction):
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+def start_of_day(now=None):
+    return datetime.fromtimestamp(now or time.time()).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+class TenantUsage:
+
+    def __init__(self, path=DEFAULT_USAGE_PATH):
+
+        self.path = path
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def record_case(self, name, case_id, status, submitted_at, started_at=None, usage=None, timings=None):
+
+        usage = usage or {}
+        with self.connect() as connection:
+            connection.execute("DELETE FROM tenant_reservations WHERE case_id = ?", (case_id,))
+            connection.execute(
+                "INSERT OR REPLACE INTO tenant_cases (case_id, tenant, status, submitted_at, started_at, finished_at, total_tokens, cost_usd, timings) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    case_id, name or DEFAULT_TENANT, status, submitted_at, started_at, time.time(),
+                    usage.get("total_tokens", 0), usage.get("total_cost_usd", 0.0), json.dumps(timings) if timings else None
+                )
+            )
+
+    def reserve(self, name, case_id):
+
+        # Cases in flight hold an estimate of their tokens until record_case replaces it with the real count,
+        # so a burst of submissions can't all be admitted against the same unused allowance
+        name = name or DEFAULT_TENANT
+        limit = tenant_quota(name)["tokens_per_day"]
+        if not limit:
+            return
+
+        today = start_of_day()
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Reservations left by a crashed process only count for the day they were made
+                connection.execute("DELETE FROM tenant_reservations WHERE created_at < ?", (today,))
+                used, average = connection.execute(
+                    "SELECT COALESCE(SUM(total_tokens), 0), AVG(total_tokens) FROM tenant_cases WHERE tenant = ? AND finished_at >= ?",
+                    (name, today)
+                ).fetchone()
+                reserved = connection.execute(
+                    "SELECT COALESCE(SUM(tokens), 0) FROM tenant_reservations WHERE tenant = ?", (name,)
+                ).fetchone()[0]
+                if used + reserved >= limit:
+                    raise QuotaExceeded(f"Tenant {name} has used or reserved its daily allowance of {int(limit)} tokens")
+                connection.execute(
+                    "INSERT OR REPLACE INTO tenant_reservations (case_id, tenant, tokens, created_at) VALUES (?, ?, ?, ?)",
+                    (case_id, name, int(average or CASE_TOKEN_ESTIMATE), time.time())
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def release(self, case_id):
+
+        with self.connect() as connection:
+            connection.execute("DELETE FROM tenant_reservations WHERE case_id = ?", (case_id,))
+
+    def summary(self, since=None):
+
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT tenant, status, submitted_at, started_at, finished_at, total_tokens, cost_usd FROM tenant_cases WHERE finished_at >= ?",
+                (since or 0,)
+            ).fetchall()
+
+        tenants = {}
+        for row in rows:
+            entry = tenants.setdefault(row["tenant"], {"cases": 0, "failed": 0, "total_tokens": 0, "cost_usd": 0.0, "wait": [], "latency": []})
+            entry["cases"] += 1
+            entry["failed"] += row["status"] != "done"
+            entry["total_tokens"] += row["total_tokens"]
+            entry["cost_usd"] += row["cost_usd"]
+            entry["latency"].append(row["finished_at"] - row["submitted_at"])
+            if row["started_at"] is not None:
+                entry["wait"].append(row["started_at"] - row["submitted_at"])
+
+        return {
+            name: {
+                "cases": entry["cases"],
+                "failed": entry["failed"],
+                "total_tokens": entry["total_tokens"],
+                "cost_usd": round(entry["cost_usd"], 6),
+                "wait_p50_s": percentile(entry["wait"], 0.5),
+                "wait_p95_s": percentile(entry["wait"], 0.95),
+                "latency_p50_s": percentile(entry["latency"], 0.5),
+                "latency_p95_s": percentile(entry["latency"], 0.95)
+            }
+            for name, entry in tenants.items()
+        }
+
+@functools.lru_cache(maxsize=1)
+def get_tenant_usage(path=DEFAULT_USAGE_PATH):
+    return TenantUsage(path) if path else None
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-tenant case counts, tokens, cost and latency")
+    parser.add_argument("--usage", default=DEFAULT_USAGE_PATH)
+    parser.add_argument("--since", help="YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else start_of_day()
+    print(json.dumps(TenantUsage(args.usage).summary(since), indent=2))
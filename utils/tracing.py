@@ -0,0 +1,167 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+_case_id = contextvars.ContextVar("neuroscope_case_id", default=None)
+_current_span = contextvars.ContextVar("neuroscope_current_span", default=None)
+
+class Span:
+
+    __slots__ = ("name", "case_id", "parent", "attributes", "start_ns", "end_ns", "error", "start_perf_ns")
+
+    def __init__(self, name, case_id=None, parent=None, attributes=None):
+
+        self.name = name
+        self.case_id = case_id
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        # Wall time only stamps the start; elapsed time comes from the monotonic clock, so clock steps can't skew it
+        self.start_ns = time.time_ns()
+        self.start_perf_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.error = None
+
+    def finish(self):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self.start_perf_ns)
+
+    @property
+    def duration(self):
+
+        if self.end_ns is not None:
+            return (self.end_ns - self.start_ns) / 1e9
+        return (time.perf_counter_ns() - self.start_perf_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "case_id": self.case_id,
+            "parent": self.parent.name if self.parent else None,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_s": self.duration,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+class NoopExporter:
+
+    def export(self, span):
+        pass
+
+class JsonlExporter:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, span):
+
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+class OpenTelemetryExporter:
+
+    def __init__(self, tracer=None):
+
+        from opentelemetry import trace
+        self.tracer = tracer or trace.get_tracer("neuroscope")
+
+    def export(self, span):
+
+        attributes = {key: value for key, value in span.attributes.items() if isinstance(value, (str, bool, int, float))}
+        if span.case_id is not None:
+            attributes["neuroscope.case_id"] = span.case_id
+        if span.parent is not None:
+            attributes["neuroscope.parent"] = span.parent.name
+
+        otel_span = self.tracer.start_span(span.name, start_time=span.start_ns, attributes=attributes)
+        if span.error is not None:
+            from opentelemetry.trace import Status, StatusCode
+            otel_span.set_status(Status(StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.end_ns)
+
+def exporter_from_env():
+
+    setting = os.environ.get("NEUROSCOPE_TRACE_EXPORTER", "")
+
+    if setting == "otel":
+        return OpenTelemetryExporter()
+    if setting.startswith("jsonl:"):
+        return JsonlExporter(setting[len("jsonl:"):])
+    return NoopExporter()
+
+_exporter = exporter_from_env()
+_listeners = []
+
+def set_exporter(exporter):
+
+    global _exporter
+    _exporter = exporter or NoopExporter()
+
+def add_listener(listener):
+
+    # Listeners see every finished span, whatever the exporter, e.g. for usage ledgers or metrics
+    _listeners.append(listener)
+
+def new_case_id():
+    return uuid.uuid4().hex
+
+def get_case_id():
+    return _case_id.get()
+
+@contextlib.contextmanager
+def case(case_id=None):
+
+    token = _case_id.set(case_id or new_case_id())
+    try:
+        yield _case_id.get()
+    finally:
+        _case_id.reset(token)
+
+def current_span():
+
+    # A detached span keeps .set() calls safe outside any traced stage
+    return _current_span.get() or Span("detached")
+
+@contextlib.contextmanager
+def span(name, **attributes):
+
+    current = Span(name, _case_id.get(), _current_span.get(), attributes)
+    token = _current_span.set(current)
+
+    try:
+        yield current
+    except BaseException as error:
+        current.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        _exporter.export(current)
+        for listener in _listeners:
+            listener(current)
+
+def traced(name=None):
+
+    def decorator(func):
+
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
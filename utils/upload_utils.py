@@ -0,0 +1,89 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+CHUNK_SIZE = 1 << 20
+MEDIA_DIR = os.environ.get("NEUROSCOPE_MEDIA_DIR", os.path.join(tempfile.gettempdir(), "neuroscope_media"))
+MEDIA_MAX_AGE = float(os.environ.get("NEUROSCOPE_MEDIA_MAX_AGE", 24 * 3600))
+
+def iter_chunks(file_obj, chunk_size=CHUNK_SIZE):
+
+    file_obj.seek(0)
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def store_upload(file_obj, suffix=".mp4", media_dir=MEDIA_DIR):
+
+    # Uploads are already in memory or spooled, so hashing them first is a read, not a write:
+    # a recording that is already stored just has its copy touched, and only new recordings are written out
+    os.makedirs(media_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(file_obj):
+        digest.update(chunk)
+
+    media_hash = digest.hexdigest()
+    path = os.path.join(media_dir, f"{media_hash}{suffix}")
+    try:
+        os.utime(path)
+        return path, media_hash
+    except FileNotFoundError:
+        pass
+
+    descriptor, temp_path = tempfile.mkstemp(suffix=".part", dir=media_dir)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            for chunk in iter_chunks(file_obj):
+                file.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return path, media_hash
+
+def touch_media(path):
+
+    # Marks a stored recording as in use so cleanup keeps it; returns False when it has already been deleted
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def cleanup_media(media_dir=MEDIA_DIR, max_age=MEDIA_MAX_AGE, keep=()):
+
+    if not os.path.isdir(media_dir):
+        return 0
+
+    keep = {os.path.abspath(path) for path in keep}
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(media_dir):
+        path = os.path.join(media_dir, name)
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+def schedule_cleanup(media_dir=MEDIA_DIR, max_age=MEDIA_MAX_AGE, interval=3600, in_use=None):
+
+    # in_use returns paths that must survive regardless of age, such as those of queued or running jobs
+    def loop():
+        while True:
+            cleanup_media(media_dir, max_age, in_use() if in_use else ())
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="neuroscope-media-cleanup", daemon=True)
+    thread.start()
+    return thread